@@ -0,0 +1,95 @@
+"""A least-recently-used cache that counts its hits and misses, and a
+font mixin that uses one to remember the widths of strings."""
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Map keys to values, forgetting the least recently used entry
+    once there are more than `maxsize` of them.
+
+    The `hits` and `misses` attributes count the lookups made through
+    get() that did and did not find a usable entry.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def hit_rate(self):
+        "The fraction of lookups that were hits, or 0.0 if none."
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self):
+        return '<LRUCache {}/{} entries, {} hits, {} misses>'.format(
+            len(self._entries), self.maxsize, self.hits, self.misses)
+
+    def get(self, key, default=None, valid=None):
+        """Return the value for `key`, or `default` if there is none.
+
+        If `valid` is given, it is called with the value, and a false
+        result makes the lookup count as a miss.
+        """
+        entries = self._entries
+        try:
+            value = entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if valid is not None and not valid(value):
+            self.misses += 1
+            return default
+        entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        entries = self._entries
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def clear(self):
+        "Forget every entry, and reset the counters."
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+
+class MemoizedWidths:
+    """Mixin for a font class whose `_measure(text)` returns the width of
+    a string, giving it width_of() and widths_of() methods that remember
+    the widths of the `width_cache_size` strings measured most recently.
+
+    The widths are kept in `width_cache`, an LRUCache whose counters
+    tell how often a measurement was saved.  If `advances` is set to an
+    AdvanceTable, widths are computed from it instead.
+    """
+
+    width_cache_size = 4096
+    advances = None
+
+    def width_of(self, text):
+        if self.advances is not None:
+            return self.advances.width_of(text)
+        cache = self.width_cache
+        width = cache.get(text)
+        if width is None:
+            width = cache[text] = self._measure(text)
+        return width
+
+    def widths_of(self, strings):
+        "Return a list of the widths of `strings`."
+        if self.advances is not None:
+            return self.advances.widths_of(strings)
+        width_of = self.width_of
+        return [width_of(text) for text in strings]
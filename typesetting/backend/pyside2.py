@@ -15,6 +15,8 @@ from PySide2.QtGui import QImage
 
 from ..units import as_mm, as_inch, mm, inch, as_pt, _quantity
 from .._prim import _draw, Graphic, DrawingPrimitive
+from .._cache import LRUCache, MemoizedWidths
+from ..glyphs import AdvanceTable
 
 
 app = QApplication(['pyside2-backend'])
@@ -26,7 +28,7 @@ def peek_image(path):
     return im.width(), im.height()
 
 
-class Font:
+class Font(MemoizedWidths):
     def __init__(self, qt_font, metrics, resolution):
         self.qt_font = qt_font
         self.metrics = metrics
@@ -35,9 +37,16 @@ class Font:
         self.height = metrics.height() * inch / resolution
         self.leading = metrics.lineSpacing() * inch / resolution - self.height
         self._resolution = resolution
+        self.width_cache = LRUCache(self.width_cache_size)
 
-    def width_of(self, text):
-        return self.metrics.width(text) * inch / self._resolution
+    def _measure(self, text):
+        return self.metrics.horizontalAdvance(text) * inch / self._resolution
+
+    def use_advance_table(self):
+        """Measure strings from a table of glyph advances and kerning
+        pairs, filled in as characters are met, instead of asking Qt."""
+        self.advances = AdvanceTable(self.metrics.horizontalAdvance,
+                                     inch / self._resolution)
 
 
 class TypeFace:
@@ -1,32 +1,132 @@
 import sys
+from functools import wraps
+from .glyphs import draw_run
 from .skeleton import Line, unroll
 from . import units
 
-def run(actions, fonts, line, next_line):
-    a = 0
-    while a < len(actions):
-        a, line = call_action(actions, a, fonts, line, next_line)
+# A good size for the memo given to run().
+MEMO_SIZE = 4096
+
+# While run() is composing, an LRUCache of the results of the actions it
+# has called, by actions, fonts, action index and layout_key(); see
+# call_action().
+action_memo = None
+
+def run(actions, fonts, line, next_line, memo=None):
+    """Run the actions, starting after `line`, and return the last line.
+
+    If `memo` is an LRUCache, like LRUCache(MEMO_SIZE), actions that
+    are laid out again at the same position, as the lookahead of
+    section titles and breaks and of widow and orphan control has them
+    do, replay their earlier result from it.  The memo can be shared
+    by several runs, as long as none of them changes the `actions` or
+    `fonts` of another in place.
+    """
+    global action_memo
+    outer_memo = action_memo
+    action_memo = memo
+    try:
+        a = 0
+        while a < len(actions):
+            a, line = call_action(actions, a, fonts, line, next_line)
+    finally:
+        action_memo = outer_memo
     return line
 
-def call_action(actions, a, fonts, line, next_line):
+def call_action(actions, a, fonts, line, next_line, **kwargs):
     action, *args = actions[a]
-    return action(actions, a, fonts, line, next_line, *args)
+    memo = action_memo
+    if memo is None:
+        return action(actions, a, fonts, line, next_line, *args, **kwargs)
+
+    key = (id(actions), id(fonts), a, tuple(sorted(kwargs.items())),
+           layout_key(line, next_line))
+    entry = memo.get(key)
+    if entry is not None:
+        return replay(entry, line)
+    a2, end_line = action(actions, a, fonts, line, next_line, *args, **kwargs)
+
+    # The entry keeps `actions` and `fonts` alive, so that no other
+    # list or dict can take their ids while the key is in the memo.
+    memo[key] = a2, line, end_line, (actions, fonts)
+    return a2, end_line
+
+def layout_key(line, next_line):
+    """Return a key that is equal for any two places where actions would
+    be laid out alike: after lines at the same y in columns of the same
+    id and geometry, by the same next_line() with the same overrides.
+
+    A next_line() that wraps another says how in its `override`
+    attribute; see overrides().  The key assumes that a layout places
+    the lines of a column by its id and geometry alone.
+    """
+    items = []
+    while True:
+        override = getattr(next_line, 'override', None)
+        if override is None or override[0] is not next_line:
+            break
+        wrapper, next_line, key = override
+        item = key(line)
+        if item:
+            items.append(item)
+    if line is None:
+        position = None
+    else:
+        column = line.column
+        position = tuple(column[1:]), tuple(column.page), line.y
+    return next_line, position, tuple(items)
+
+def overrides(next_line2, next_line, key):
+    """Mark `next_line2` as a wrapper of `next_line`, whose overrides as
+    seen by actions starting after a given line are key(line), or an
+    empty tuple if it acts just like `next_line` from there on."""
+    next_line2.override = next_line2, next_line, key
+    return next_line2
+
+def replay(entry, line):
+    """Return a memoized (a, line) result of an action, with its lines
+    rebuilt after `line`.  Those on the page the action started on move
+    to the page of `line`; the rest keep the very columns and pages they
+    were laid out in, which a layout may compare by identity."""
+    a2, start_line, end_line, owners = entry
+    columns = {}
+    start_page = page = None
+    if start_line is not None:
+        start_page = start_line.column.page
+        page = line.column.page
+        columns[id(start_line.column)] = line.column
+    for old in unroll(start_line, end_line)[1:]:
+        column = columns.get(id(old.column))
+        if column is None:
+            column = old.column
+            if column.page is start_page:
+                column = column._replace(page=page)
+            columns[id(old.column)] = column
+        line = Line(line, column, old.y, list(old.graphics))
+    return a2, line
+
+def accepts_looseness(actions, a):
+    """Whether the action at `a` takes a `looseness` keyword, asking it
+    to set its text that many lines longer (or shorter) if it can."""
+    return getattr(actions[a][0], 'accepts_looseness', False)
 
 def add_leading(line, next_line, leading=9999999 * units.pt):
     """Add `leading` to the leading of the first line after `line`."""
+    @wraps(next_line)
     def next_line2(line2, leading2, height):
         if line2 is line:
             leading2 = leading
         return next_line(line2, leading2, height)
-    return next_line2
+
+    # Actions never go back before the line they start after, so this
+    # can only make a difference to one starting right after `line`.
+    return overrides(next_line2, next_line, lambda start: (
+        ('leading', leading) if start is line else ()))
 
 def new_page(actions, a, fonts, line, next_line):
     if line is None:
         return a + 1, line
-    def next_line2(line2, leading, height):
-        if line2 is line:
-            leading = 9999999 * pt
-        return next_line(line2, leading, height)
+    next_line2 = add_leading(line, next_line)
     return call_action(actions, a + 1, fonts, line, next_line2)
 
 def new_recto_page(actions, a, fonts, line, next_line):
@@ -51,11 +151,7 @@ def wrap_graphic(original_graphic, original_line):
     return tuple(call_and_args)
 
 def space_before_and_after(actions, a, fonts, line, next_line, above, below):
-    def next_line2(line2, leading, height):
-        if line2 is line:
-            leading = above
-        return next_line(line2, leading, height)
-
+    next_line2 = add_leading(line, next_line, above)
     a2, line2 = call_action(actions, a + 1, fonts, line, next_line2)
 
     if below:
@@ -141,12 +237,19 @@ def section_title(actions, a, fonts, line, next_line):
     if first_line_of_title.column is line_after_title.column:
         return a3, following_line
 
-    # Otherwise, move the title to the top of the next column.
-    def next_line2(line2, leading, height):
-        if line2 is line:
-            leading = 9999999
-        return next_line(line2, leading, height)
+    # Try setting the title a line shorter, to make room after it.
+    if accepts_looseness(actions, a1):
+        a2, title_line = call_action(actions, a1, fonts, line, next_line,
+                                     looseness=-1)
+        if len(unroll(line, title_line)) < len(lines1):
+            a3, following_line = call_action(actions, a2, fonts,
+                                             title_line, next_line)
+            lines2 = unroll(title_line, following_line)
+            if first_line_of_title.column is lines2[1].column:
+                return a3, following_line
 
+    # Otherwise, move the title to the top of the next column.
+    next_line2 = add_leading(line, next_line, 9999999)
     a2, title_line = call_action(actions, a1, fonts, line, next_line2)
     return a2, title_line
 
@@ -161,9 +264,13 @@ def avoid_widows_and_orphans(actions, a, fonts, line, next_line):
     original_a2 = a2
     original_end_line = end_line
 
+    # The looseness that fixed a widow, which later reflows keep.
+    kwargs = {}
+
     def reflow():
         nonlocal end_line, lines
-        a2, end_line = call_action(actions, a + 1, fonts, line, fancy_next_line)
+        a2, end_line = call_action(actions, a + 1, fonts, line,
+                                   fancy_next_line, **kwargs)
         lines = unroll(line, end_line)
 
     def is_orphan():
@@ -178,9 +285,23 @@ def avoid_widows_and_orphans(actions, a, fonts, line, next_line):
 
     def fix_widow():
         nonlocal end_line, lines
+        if accepts_looseness(actions, a + 1):
+            # Setting the paragraph a line shorter pulls the widow back;
+            # a line longer gives it company.  Either way, no line is
+            # left empty.
+            for looseness in -1, 1:
+                a3, end_line3 = call_action(actions, a + 1, fonts, line,
+                                            fancy_next_line,
+                                            looseness=looseness)
+                lines3 = unroll(line, end_line3)
+                if lines3[-2].column is lines3[-1].column:
+                    end_line, lines = end_line3, lines3
+                    kwargs['looseness'] = looseness
+                    return
         skips.add((lines[-2].column.id, lines[-2].y * units.pt))
         reflow()
 
+    @wraps(next_line)
     def fancy_next_line(line, leading, height):
         line2 = next_line(line, leading, height)
         if (line2.column.id, line2.y * units.pt) in skips:
@@ -188,6 +309,8 @@ def avoid_widows_and_orphans(actions, a, fonts, line, next_line):
         return line2
 
     skips = set()
+    overrides(fancy_next_line, next_line,
+              lambda start: ('skips', frozenset(skips)) if skips else ())
 
     if is_orphan():
         fix_orphan()
@@ -286,14 +409,11 @@ def split_texts_into_lines(fonts_and_texts):
 
 def draw_text(fonts, line, painter, x, font_name, text):
     font = fonts[font_name]
-    painter.setFont(font.qt_font)
-
-    x = x * units.pt
     y_offset = line.y - font.descent * units.pt
-
-    painter.drawText(units.as_inch(line.column.x + x) * 1200,
-                     units.as_inch(line.column.y + y_offset) * 1200,
-                     text)
+    draw_run(font, painter,
+             units.as_inch(line.column.x) * 1200,
+             units.as_inch(line.column.y + y_offset) * 1200,
+             [(x, text)])
 
 def die(*args):
     strings = []
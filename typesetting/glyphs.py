@@ -0,0 +1,131 @@
+"""Measuring strings from a table of glyph advances and kerning pairs,
+and drawing them as glyph runs."""
+
+# The most by which a width from an AdvanceTable may differ from the
+# font's own, per string and in the table's units, for a font whose
+# shaping is pairwise (no ligatures or contextual forms).  Qt's
+# unrounded advances (QFontMetricsF.horizontalAdvance) are whole 64ths
+# of a device unit, which floats add up exactly: for the Gentium and
+# Old Standard fonts in fonts/, at 11pt and 1200 dpi, max_error() is
+# zero over the 4889 distinct words of the README and examples, where
+# a table of Qt's whole-unit widths is up to 9 units out.  A font with
+# ligatures is not pairwise; DejaVu Serif's "ffi" is 4 units out.
+TOLERANCE = 1e-6
+
+
+class AdvanceTable:
+    """Measure strings by adding up the advance of each character and
+    the kerning between each adjacent pair, as found by asking `measure`
+    for the width of every character and pair the first time it is
+    seen.  Widths are multiplied by `scale`, which may be a unit.
+
+    Ligatures and other shaping beyond pairs are not modelled; use
+    max_error() to check a font against some sample text.
+    """
+
+    def __init__(self, measure, scale=1.0):
+        self._measure = measure
+        self.scale = scale
+        self._advances = {}
+        self._kerning = {}
+
+    def __len__(self):
+        "Return the number of characters measured so far."
+        return len(self._advances)
+
+    def advance(self, char):
+        "Return the unscaled advance of `char`."
+        advance = self._advances.get(char)
+        if advance is None:
+            advance = self._advances[char] = self._measure(char)
+        return advance
+
+    def kerning(self, left, right):
+        "Return the unscaled kerning between `left` and `right`."
+        pair = left + right
+        kerning = self._kerning.get(pair)
+        if kerning is None:
+            kerning = self._kerning[pair] = (
+                self._measure(pair) - self.advance(left) - self.advance(right))
+        return kerning
+
+    def width_of(self, text):
+        width = sum(self.advance(char) for char in text)
+        width += sum(self.kerning(left, right)
+                     for left, right in zip(text, text[1:]))
+        return width * self.scale
+
+    def widths_of(self, strings):
+        """Return a list of the widths of `strings`, computed together
+        with NumPy array operations."""
+        import numpy
+
+        strings = list(strings)
+        text = ''.join(strings)
+        if not text:
+            return [0.0 * self.scale for string in strings]
+        lengths = numpy.array([len(string) for string in strings])
+        starts = numpy.cumsum(lengths) - lengths
+
+        # Number each distinct character, and look each one up once.
+        codes = numpy.frombuffer(text.encode('utf-32-le'), numpy.uint32)
+        unique, chars = numpy.unique(codes, return_inverse=True)
+        unique = [chr(code) for code in unique.tolist()]
+        values = numpy.array([self.advance(char) for char in unique],
+                             float)[chars]
+
+        # Likewise each distinct pair of neighbours within a string,
+        # charging its kerning to the first character of the pair.
+        if len(chars) > 1:
+            pairs = chars[:-1] * len(unique) + chars[1:]
+            inside = numpy.ones(len(pairs), bool)
+            ends = (starts + lengths - 1)[lengths > 0]
+            inside[ends[ends < len(pairs)]] = False
+            distinct, pair_index = numpy.unique(pairs[inside],
+                                                return_inverse=True)
+            kerning = numpy.array(
+                [self.kerning(unique[pair // len(unique)],
+                              unique[pair % len(unique)])
+                 for pair in distinct.tolist()])
+            values[:-1][inside] += kerning[pair_index]
+
+        # Sum over each string; reduceat() gives an empty string the
+        # value at its start, so those are set apart.
+        nonempty = lengths > 0
+        widths = numpy.zeros(len(strings))
+        widths[nonempty] = numpy.add.reduceat(values, starts[nonempty])
+        widths = widths * self.scale
+        if isinstance(widths, numpy.ndarray):
+            return widths.tolist()
+        return list(widths)
+
+    def max_error(self, strings):
+        """Return the largest difference between the width of any of
+        `strings` found by this table and by measuring it whole, in the
+        units of `measure`."""
+        widths = self.widths_of(strings)
+        return max((abs(width / self.scale - self._measure(string))
+                    for string, width in zip(strings, widths)), default=0.0)
+
+
+def widths_of(font, strings):
+    """Return a list of the widths of `strings` in `font`, measured all
+    at once if the font supports it."""
+    bulk = getattr(font, 'widths_of', None)
+    if bulk is not None:
+        return bulk(strings)
+    width_of = font.width_of
+    return [width_of(string) for string in strings]
+
+def draw_run(font, painter, x0, y, fragments):
+    """Draw (x, text) `fragments` of a line in `font`, with x in points
+    from the device position (x0, y), as a single glyph run if the
+    font can draw one."""
+
+    font_draw_run = getattr(font, 'draw_run', None)
+    if font_draw_run is not None:
+        font_draw_run(painter, x0, y, fragments)
+        return
+    painter.setFont(font.qt_font)
+    for x, text in fragments:
+        painter.drawText(x0 + x * 1200 / 72, y, text)
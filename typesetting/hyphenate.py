@@ -1,74 +1,280 @@
 """ Hyphenation, using Frank Liang's algorithm.
 
     This module provides a single function to hyphenate words.  hyphenate_word takes
-    a string (the word), and returns a list of parts that can be separated by hyphens.
+    a string (the word), and returns a tuple of parts that can be separated by hyphens.
 
     >>> hyphenate_word("hyphenation")
-    ['hy', 'phen', 'ation']
+    ('hy', 'phen', 'ation')
     >>> hyphenate_word("supercalifragilisticexpialidocious")
-    ['su', 'per', 'cal', 'ifrag', 'ilis', 'tic', 'ex', 'pi', 'ali', 'do', 'cious']
+    ('su', 'per', 'cal', 'ifrag', 'ilis', 'tic', 'ex', 'pi', 'ali', 'do', 'cious')
     >>> hyphenate_word("project")
-    ['project']
+    ('project',)
+
+    hyphenate_many does the same for a whole vocabulary at once.
+
+    As part of the typesetting package, this runs as a module:
+    "python -m typesetting.hyphenate word ..." prints each word with
+    its hyphens, and without any words it runs these doctests.
 
     Ned Batchelder, July 2007.
     This Python code is in the public domain.
 """
 
+import hashlib
+import mmap
+import os
 import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from functools import partial
+from itertools import chain, count
+
+from ._cache import LRUCache
 
 __version__ = '1.0.20070709'
 
+class PackedTrie:
+    """Liang's pattern trie, packed into a double array, with the failure
+    links of an Aho-Corasick automaton.
+
+    States are indexes into the `base` and `check` arrays, with the root
+    at 0.  The character numbered c by `codes`, counting from 1, leads
+    from state s to state t = base[s] + c if check[t] == s, and nowhere
+    otherwise.  fail[s] is the state for the longest proper suffix of
+    the string of s that is in the trie.
+
+    The points of every pattern that ends at state s, including those
+    reached through its failure links, are merged into one vector,
+    values[offsets[s]:offsets[s+1]], whose first value falls shifts[s]
+    points after the last character of the match.  Being flat arrays, a
+    trie can be written to a file with save() and mapped back in with
+    load().
+    """
+
+    MAGIC = b'LIANGDA2'
+    HEADER = struct.Struct('=8sBxxxiii')
+
+    def __init__(self, alphabet, base, check, fail, shifts, offsets, values):
+        self.alphabet = alphabet
+        self.codes = {c: code for code, c in enumerate(alphabet, 1)}
+        self.base = base
+        self.check = check
+        self.fail = fail
+        self.shifts = shifts
+        self.offsets = offsets
+        self.values = values
+
+    @classmethod
+    def from_patterns(cls, patterns):
+        "Build a trie from whitespace separated Liang `patterns`."
+        tree = {}
+        for pattern in patterns.split():
+            # Convert the a pattern like 'a1bc3d4' into a string of chars
+            # 'abcd' and a list of points [ 1, 0, 3, 4 ].
+            chars = re.sub('[0-9]', '', pattern)
+            points = [ int(d or 0) for d in re.split(r"\D", pattern) ]
+            t = tree
+            for c in chars:
+                t = t.setdefault(c, {})
+            t[None] = points
+
+        alphabet = ''.join(sorted(set(re.sub('[0-9\\s]', '', patterns))))
+        codes = {c: code for code, c in enumerate(alphabet, 1)}
+
+        # Give the children of each node, breadth first, the lowest base
+        # at which all of their slots are free.  Bit t of `used` is set
+        # once slot t is taken, and `free` lists the slots below its
+        # highest bit that are not.
+        base = [0]
+        check = [-1]
+        used = 1
+        free = []
+        points = {}
+        edges = []
+        queue = [(0, tree)]
+        for s, node in queue:
+            if None in node:
+                points[s] = node[None]
+            children = sorted((codes[c], child) for c, child in node.items()
+                              if c is not None)
+            if not children:
+                continue
+            first = children[0][0]
+            mask = 0
+            for code, child in children:
+                mask |= 1 << (code - first)
+            for f in chain(free, count(len(check))):
+                if f > first and not (used >> f) & mask:
+                    break
+            b = base[s] = f - first
+            for code, child in children:
+                t = b + code
+                if t >= len(check):
+                    free.extend(range(len(check), t + 1))
+                    check.extend([-1] * (t + 1 - len(check)))
+                    base.extend([0] * (t + 1 - len(base)))
+                check[t] = s
+                used |= 1 << t
+                del free[bisect_left(free, t)]
+                queue.append((t, child))
+                edges.append((s, code, t))
+
+        # Pad the arrays so that no transition needs a bounds check.
+        size = max(base) + len(alphabet) + 1
+        check.extend([-1] * (size - len(check)))
+        base.extend([0] * (size - len(base)))
+
+        # Follow the edges breadth first, so that the failure link and
+        # merged points of each shallower state are already known.  The
+        # points are keyed by their position relative to the last
+        # character of the match.
+        fail = [0] * size
+        merged = {0: {}}
+        for s, code, t in edges:
+            f = s
+            while f:
+                f = fail[f]
+                u = base[f] + code
+                if check[u] == f:
+                    fail[t] = u
+                    break
+            vector = merged[t] = dict(merged[fail[t]])
+            own = points.get(t, ())
+            for j, p in enumerate(own, 2 - len(own)):
+                if p > vector.get(j, 0):
+                    vector[j] = p
+
+        shifts = array('i', [0] * size)
+        offsets = array('i', [0])
+        values = array('b')
+        for s in range(size):
+            vector = merged.get(s)
+            if vector:
+                shifts[s] = low = min(vector)
+                values.extend(vector.get(j, 0)
+                              for j in range(low, max(vector) + 1))
+            offsets.append(len(values))
+        return cls(alphabet, array('i', base), array('i', check),
+                   array('i', fail), shifts, offsets, values)
+
+    def save(self, path):
+        "Write the trie to the file at `path`, for load()."
+        alphabet = self.alphabet.encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, sys.byteorder == 'little',
+                                     len(alphabet), len(self.check),
+                                     len(self.values)))
+            f.write(alphabet)
+            f.write(bytes(-len(alphabet) % 4))
+            for a in (self.base, self.check, self.fail, self.shifts,
+                      self.offsets, self.values):
+                f.write(array(a.typecode, a).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Map a trie written by save() into memory, raising ValueError
+        if the file does not hold one for this machine."""
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = cls.HEADER
+        if len(data) < header.size:
+            raise ValueError('%s is not a packed hyphenation trie' % path)
+        magic, little, n, size, count = header.unpack_from(data)
+        if magic != cls.MAGIC or little != (sys.byteorder == 'little'):
+            raise ValueError('%s is not a packed hyphenation trie' % path)
+        start = header.size + n + (-n % 4)
+        if len(data) != start + 4 * (5 * size + 1) + count:
+            raise ValueError('%s is truncated' % path)
+
+        view = memoryview(data)
+        alphabet = bytes(view[header.size:header.size + n]).decode('utf-8')
+        def take(length, format, itemsize):
+            nonlocal start
+            a = view[start:start + length * itemsize].cast(format)
+            start += length * itemsize
+            return a
+        base = take(size, 'i', 4)
+        check = take(size, 'i', 4)
+        fail = take(size, 'i', 4)
+        shifts = take(size, 'i', 4)
+        offsets = take(size + 1, 'i', 4)
+        values = take(count, 'b', 1)
+        return cls(alphabet, base, check, fail, shifts, offsets, values)
+
+    def points(self, word):
+        """Return the Liang points of `word`, which should be lower case
+        and start and end with a '.', found in a single pass."""
+        codes = self.codes
+        base = self.base
+        check = self.check
+        fail = self.fail
+        shifts = self.shifts
+        offsets = self.offsets
+        values = self.values
+        points = [0] * (len(word)+1)
+        s = 0
+        for i, c in enumerate(word):
+            # Characters not in the alphabet have the code 0, which never
+            # leads anywhere, since base[s] is no child of s.
+            code = codes.get(c, 0)
+            while s and check[base[s] + code] != s:
+                s = fail[s]
+            t = base[s] + code
+            s = t if check[t] == s else 0
+            start = offsets[s]
+            end = offsets[s+1]
+            if start != end:
+                k = i + shifts[s] - start
+                for j in range(start, end):
+                    p = values[j]
+                    if p > points[k+j]:
+                        points[k+j] = p
+        return points
+
+
 class Hyphenator:
+    # How many words to remember the pieces of.
+    memo_size = 65536
+
     def __init__(self, patterns, exceptions=''):
-        self.tree = {}
-        for pattern in patterns.split():
-            self._insert_pattern(pattern)
+        """Hyphenate using the Liang `patterns`, given either as text or
+        as a PackedTrie, and the hyphenated `exceptions`."""
+        self.memo = LRUCache(self.memo_size)
+        if isinstance(patterns, PackedTrie):
+            self.trie = patterns
+        else:
+            self.trie = PackedTrie.from_patterns(patterns)
 
         self.exceptions = {}
         for ex in exceptions.split():
             # Convert the hyphenated pattern into a point array for use later.
-            self.exceptions[ex.replace('-', '')] = [0] + [ int(h == '-') for h in re.split(r"[a-z]", ex) ]
-
-    def _insert_pattern(self, pattern):
-        # Convert the a pattern like 'a1bc3d4' into a string of chars 'abcd'
-        # and a list of points [ 1, 0, 3, 4 ].
-        chars = re.sub('[0-9]', '', pattern)
-        points = [ int(d or 0) for d in re.split("[.a-z]", pattern) ]
-
-        # Insert the pattern into the tree.  Each character finds a dict
-        # another level down in the tree, and leaf nodes have the list of
-        # points.
-        t = self.tree
-        for c in chars:
-            if c not in t:
-                t[c] = {}
-            t = t[c]
-        t[None] = points
+            self.exceptions[ex.replace('-', '')] = [0] + [ int(h == '-') for h in re.split(r"[^-]", ex) ]
 
     def hyphenate_word(self, word):
-        """ Given a word, returns a list of pieces, broken at the possible
+        """ Given a word, returns a tuple of pieces, broken at the possible
             hyphenation points.
         """
+        pieces = self.memo.get(word)
+        if pieces is None:
+            pieces = self.memo[word] = tuple(self._pieces(word))
+        return pieces
+
+    def hyphenate_many(self, words):
+        """Return a dict mapping each of `words` to its pieces, doing the
+        work for each distinct word only once."""
+        return {word: self.hyphenate_word(word) for word in set(words)}
+
+    def _pieces(self, word):
         # Short words aren't hyphenated.
         if len(word) <= 4:
             return [word]
         # If the word is an exception, get the stored points.
-        if word.lower() in self.exceptions:
-            points = self.exceptions[word.lower()]
-        else:
-            work = '.' + word.lower() + '.'
-            points = [0] * (len(work)+1)
-            for i in range(len(work)):
-                t = self.tree
-                for c in work[i:]:
-                    if c in t:
-                        t = t[c]
-                        if None in t:
-                            p = t[None]
-                            for j in range(len(p)):
-                                points[i+j] = max(points[i+j], p[j])
-                    else:
-                        break
+        lower = word.lower()
+        points = self.exceptions.get(lower)
+        if points is None:
+            points = self.trie.points('.' + lower + '.')
             # No hyphens in the first two chars or the last two.
             points[1] = points[2] = points[-2] = points[-3] = 0
 
@@ -507,11 +713,182 @@ presents project projects reci-procity re-cog-ni-zance ref-or-ma-tion
 ret-ri-bu-tion ta-ble
 """
 
-hyphenator = Hyphenator(patterns, exceptions)
-hyphenate_word = hyphenator.hyphenate_word
+# The directory where compiled pattern tries are kept between runs, or
+# None for the user's cache directory, or '' to not keep them at all.
+cache_directory = None
+
+def trie_cache_path(patterns):
+    """Return the path at which the trie for `patterns` is cached, or
+    None if tries are not being cached."""
+    directory = cache_directory
+    if directory is None:
+        directory = os.path.join(
+            os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'),
+            'typesetting')
+    if not directory:
+        return None
+    digest = hashlib.sha1(patterns.encode('utf-8')).hexdigest()
+    version = PackedTrie.MAGIC.decode('ascii').lower()
+    return os.path.join(directory, '%s-%s.trie' % (version, digest[:20]))
+
+# The compiled tries in use, by pattern text.
+tries = {}
+
+def compiled_trie(patterns):
+    """Return a PackedTrie of `patterns`, mapped from the cache if they
+    were compiled in an earlier run, and otherwise compiled and cached."""
+    trie = tries.get(patterns)
+    if trie is None:
+        trie = tries[patterns] = _compiled_trie(patterns)
+    return trie
+
+def _compiled_trie(patterns):
+    path = trie_cache_path(patterns)
+    if path is not None:
+        try:
+            return PackedTrie.load(path)
+        except (OSError, ValueError):
+            pass
+    trie = PackedTrie.from_patterns(patterns)
+    if path is not None:
+        # Write to a temporary file first, so no other process maps
+        # a half written trie.
+        temporary = '%s.%d' % (path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            trie.save(temporary)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+        else:
+            _remove_stale_tries(os.path.dirname(path))
+    return trie
+
+def _remove_stale_tries(directory):
+    "Remove the tries cached in `directory` in any earlier format."
+    current = PackedTrie.MAGIC.decode('ascii').lower() + '-'
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if (name.startswith('liangda') and name.endswith('.trie')
+                and not name.startswith(current)):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+def read_tex_patterns(text):
+    """Return the patterns and hyphenated exceptions, each as a single
+    string, of the text of a TeX hyphenation file like hyph-en-us.tex."""
+    text = re.sub(r'%.*', '', text)
+    def arguments(command):
+        pattern = r'\\' + command + r'\s*\{([^}]*)\}'
+        return ' '.join(' '.join(re.findall(pattern, text)).split())
+    return arguments('patterns'), arguments('hyphenation')
+
+# The language hyphenated when none is named.
+default_language = 'en'
+
+# Directories to search for the TeX hyphenation file hyph-<language>.tex
+# of a language that has not been registered, like the patterns/tex
+# directory of hyph-utf8.
+pattern_path = []
+
+# The (patterns, exceptions) text, or the path of a TeX hyphenation
+# file, of each registered language, and the Hyphenator of each
+# language used so far.
+languages = {'en': (patterns, exceptions)}
+hyphenators = {}
+
+def register_language(language, patterns='', exceptions='', path=None):
+    """Hyphenate `language` with the Liang `patterns` and hyphenated
+    `exceptions`, or with those of the TeX hyphenation file at `path`,
+    which is only read once the language is used."""
+    languages[language] = path if path is not None else (patterns,
+                                                          exceptions)
+    hyphenators.pop(language, None)
+
+def get_hyphenator(language=None):
+    """Return the Hyphenator for `language`, building it on first use
+    from the patterns registered for it or found on pattern_path."""
+    if language is None:
+        language = default_language
+    hyphenator = hyphenators.get(language)
+    if hyphenator is None:
+        language_patterns, language_exceptions = language_source(language)
+        hyphenator = hyphenators[language] = Hyphenator(
+            compiled_trie(language_patterns), language_exceptions)
+    return hyphenator
+
+def language_source(language):
+    """Return the (patterns, exceptions) text of `language`, as
+    registered or read from its TeX hyphenation file on pattern_path."""
+    source = languages.get(language)
+    if source is None:
+        filename = 'hyph-%s.tex' % language
+        for directory in pattern_path:
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                source = path
+                break
+        else:
+            raise LookupError('no hyphenation patterns for %r' % language)
+    if isinstance(source, str):
+        with open(source, encoding='utf-8') as f:
+            source = read_tex_patterns(f.read())
+    return source
+
+def hyphenate_word(word, language=None):
+    return get_hyphenator(language).hyphenate_word(word)
+
+# hyphenate_many() shares out the new words among worker processes once
+# there are at least this many of them.
+POOL_THRESHOLD = 50000
+
+def hyphenate_many(words, processes=None, language=None):
+    """Return a dict mapping each of `words` to its pieces in `language`,
+    doing the work for each distinct word only once.  If `processes` is
+    given and there are many new words, they are hyphenated by that many
+    worker processes."""
+    if language is None:
+        language = default_language
+    hyphenator = get_hyphenator(language)
+    vocabulary = set(words)
+    results = {}
+    if processes and len(vocabulary) >= POOL_THRESHOLD:
+        memo = hyphenator.memo
+        new = [word for word in vocabulary if word not in memo]
+        if len(new) >= POOL_THRESHOLD:
+            from concurrent.futures import ProcessPoolExecutor
+            chunksize = -(-len(new) // (4 * processes))
+            # Workers that are spawned rather than forked start from a
+            # fresh import of this module, so they are told the
+            # language's patterns and where to cache them.
+            with ProcessPoolExecutor(
+                    processes, initializer=_start_worker,
+                    initargs=(language, language_source(language),
+                              cache_directory)) as pool:
+                work = partial(hyphenate_word, language=language)
+                results = dict(zip(new, pool.map(work, new,
+                                                 chunksize=chunksize)))
+            for word, pieces in results.items():
+                memo[word] = pieces
+    results.update(hyphenator.hyphenate_many(vocabulary.difference(results)))
+    return results
+
+def _start_worker(language, source, directory):
+    "Set up a hyphenate_many() worker process to hyphenate `language`."
+    global cache_directory
+    cache_directory = directory
+    register_language(language, *source)
 
-del patterns
-del exceptions
+def __getattr__(name):
+    if name == 'hyphenator':
+        return get_hyphenator()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 if __name__ == '__main__':
     import sys
@@ -2,163 +2,524 @@
 
 from __future__ import print_function
 
+import heapq
 import re
-from .texlib.wrap import ObjectList, Box, Glue, Penalty
-from .hyphenate import hyphenate_word
+from collections import namedtuple
+from ._cache import LRUCache
+from .texlib.wrap import (
+    ObjectList, BreakerStats, BOX, GLUE, PENALTY, choose_line_count, to_sp,
+)
+from .glyphs import draw_run, widths_of
+from .hyphenate import hyphenate_many
 from . import units
 
 NONWORD = re.compile(r'(\W+)')
 BREAKING_SPACE = re.compile(r'[ \n]+')
-ZERO_WIDTH_BREAK = Glue(0, 0, 0)
+TOLERANCES = (1, 2, 3, 4, 5, 6, 7)  # TODO: went to 7 to avoid errors
+
+# Like TeX's pretolerance: each paragraph is first broken without any
+# hyphens at this tolerance, and only hyphenated and broken at each of
+# the TOLERANCES if that fails.  None skips the first try.
+PRETOLERANCE = 1
+CHECKPOINT_INTERVAL = 64
+
+# Paragraphs of more than BEAM_THRESHOLD items are broken keeping only
+# the BEAM_WIDTH best active nodes in each fitness class, trading the
+# guarantee of the best breaks for a bound on the time taken.
+BEAM_THRESHOLD = 10000
+BEAM_WIDTH = 32
+
+# knuth_lines() has to break a paragraph to the end before it can tell
+# whether the setting without hyphens works, so it only tries that for
+# paragraphs of at most this many items, and streams the rest at once.
+STREAM_PRETOLERANCE_ITEMS = 4000
+
+# Break lines with widths in whole scaled points rather than floats, so
+# that the same paragraph always comes out the same, to the last bit.
+SCALED_POINTS = True
+
+# The ObjectLists of the paragraphs set recently, keyed on their texts
+# and the identity of the fonts that measured them, so that setting a
+# paragraph again, looser or tighter or on different lines, goes
+# straight to line breaking and resumes that from checkpoints.  Each
+# entry also holds the fonts, which keeps their ids from being reused.
+object_lists = LRUCache(maxsize=64)
+
+# Line breaking results, keyed on the digest of a paragraph's items and
+# the parameters used to break them.  Each entry holds the line lengths
+# the breaking consulted, the breakpoints, and the finished x-lists for
+# each indent laid out so far; or, for the alternatives every looseness
+# but zero is chosen from, the line lengths and the alternatives.
+break_cache = LRUCache(maxsize=256)
+
+# A line of a paragraph: the items of the ObjectList `olist` from `start`
+# up to the breakpoint `end`, set with the adjustment ratio `ratio` after
+# `indent`, and starting in the font named `font_name`.  The positions of
+# its fragments are only worked out, by line_fragments(), to draw it.
+LineRecord = namedtuple('LineRecord', 'olist start end ratio indent font_name')
+
+# Set this to a DocumentStats instance to have knuth_paragraph() record
+# the line breaking work for every paragraph of a document in it.
+document_stats = None
+
+
+class DocumentStats:
+    """Line breaking statistics for a document.
+
+    `total` is a BreakerStats summing every paragraph that had to be
+    broken, `cached` counts those whose breaks came from the cache, and
+    `slowest` lists (seconds, text, BreakerStats) for the `keep`
+    paragraphs that took longest, slowest first.
+    """
+
+    def __init__(self, keep=10):
+        self.total = BreakerStats()
+        self.cached = 0
+        self.keep = keep
+        self._slowest = []              # A heap of the slowest so far
+        self._count = 0
+
+    def add(self, fonts_and_texts, stats):
+        "Record the stats of a paragraph."
+        self.total.add(stats)
+        text = ''.join(fragment[1] for fragment in fonts_and_texts)
+        self._count += 1
+        entry = (stats.seconds, self._count, text, stats)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def slowest(self):
+        return [(seconds, text, stats) for seconds, count, text, stats
+                in sorted(self._slowest, reverse=True)]
 
 
 class LineLengthCalculator:
-    def __init__(self, start_line, next_line_func):
+    def __init__(self, start_line, next_line_func, column_width=None,
+                 scaled=False):
         self._start_line = start_line
         self._lines = [start_line]
         self._next_line_func = next_line_func
+        self._scaled = scaled
+
+        # If the layout gives every column it makes the same width, the
+        # line length is constant from the first line it makes on, so
+        # the line breaker can merge its nodes from there.
+        self.easy_line = None
+        if column_width is not None:
+            self.easy_line = 0 if self[0] == self._length(column_width) else 1
 
     def __getitem__(self, i):
         assert i >= 0
         while i >= len(self._lines):
             self._lines.append(self.next_line())
-        return units.as_pt(self._lines[i].column.width)
+        return self._length(self._lines[i].column.width)
+
+    def _length(self, width):
+        "Convert a width to points, or to scaled points if `scaled`."
+        width = units.as_pt(width)
+        return to_sp(width) if self._scaled else width
 
     def next_line(self):
         return self._next_line_func(self._lines[-1])
 
+    def lengths(self):
+        "Return the lengths of the lines computed so far."
+        return [self._length(line.column.width) for line in self._lines]
+
+    def matches(self, lengths):
+        "Whether the first lines have exactly the given `lengths`."
+        return all(self[i] == length for i, length in enumerate(lengths))
+
 
 def knuth_paragraph(actions, a, fonts, line, next_line,
-                    indent, first_indent, fonts_and_texts):
+                    indent, first_indent, fonts_and_texts, looseness=0):
+    font_name = fonts_and_texts[0][0]
+    font = fonts[font_name]
+
+    leading = max(fonts[fragment[0]].leading for fragment in fonts_and_texts) * units.pt
+    height = max(fonts[fragment[0]].height for fragment in fonts_and_texts) * units.pt
+
+    line = next_line(line, leading, height)
+
+    if first_indent is True:
+        first_indent = font.height
+
+    emergency_stretch = to_sp(font.height) if SCALED_POINTS else font.height
+
+    # line_lengths = [line.column.width]  # TODO: support interesting shapes
+    # indented_lengths = [length - indent for length in line_lengths]
+
+    line_lengths = LineLengthCalculator(line,
+                                       lambda l: next_line(l, leading, height),
+                                       getattr(next_line, 'column_width', None),
+                                       SCALED_POINTS)
+    stats = None if document_stats is None else BreakerStats()
+    entry = None
+
+    # Try breaking the paragraph without hyphens first.
+    if PRETOLERANCE is not None:
+        olist = cached_object_list(fonts, first_indent, fonts_and_texts,
+                                   hyphenate=False)
+        entry = cached_breaks(olist, line_lengths, (PRETOLERANCE,), None,
+                              looseness, stats, exact=True)
+
+    # Otherwise, or if that cannot meet the looseness in full, escalate
+    # through the tolerances within a single call; if even the loosest
+    # fails, give every line an em of emergency stretch.
+    if entry is None or entry[1] is None:
+        olist = cached_object_list(fonts, first_indent, fonts_and_texts)
+        entry = cached_breaks(olist, line_lengths, TOLERANCES,
+                              emergency_stretch, looseness, stats)
+
+    if stats is not None:
+        if stats.passes:
+            document_stats.add(fonts_and_texts, stats)
+        else:
+            document_stats.cached += 1
+
+    lengths, breaks, settings = entry
+    records = settings.get(indent)
+    if records is None:
+        records = settings[indent] = knuth_records(
+            olist, breaks, line_lengths, indent, font_name)
+
+    for record in records:
+        line.graphics.append((knuth_draw, record))
+        line = next_line(line, leading, height)
+
+    return a + 1, line.previous
+
+knuth_paragraph.accepts_looseness = True
+
+def cached_breaks(olist, line_lengths, tolerances, emergency_stretch,
+                  looseness, stats, exact=False):
+    """Return the break_cache entry for breaking `olist` into lines of
+    `line_lengths`, breaking it if there is none yet.  Its breaks are
+    None if no tolerance admits a solution, or, if `exact` is set, if
+    none admits exactly `looseness` more lines than the best setting,
+    as TeX's pretolerance pass fails.  Every looseness but zero is
+    served from the same cached_alternatives()."""
+
+    beam_width = beam_width_for(olist)
+    key = (olist.digest(), tolerances, emergency_stretch, looseness,
+           exact, beam_width)
+    entry = break_cache.get(key, valid=lambda entry:
+                            line_lengths.matches(entry[0]))
+    if entry is None:
+        if looseness:
+            lengths, alternatives = cached_alternatives(
+                olist, line_lengths, tolerances, emergency_stretch,
+                beam_width, stats)
+            breaks = None
+            if alternatives is not None:
+                n = choose_line_count(alternatives, looseness)
+                if not exact or n == choose_line_count(alternatives) + looseness:
+                    demerits, breaks = alternatives[n]
+        else:
+            try:
+                breaks = olist.compute_breakpoints(
+                    line_lengths,
+                    tolerance=tolerances,
+                    emergency_stretch=emergency_stretch,
+                    checkpoint_interval=CHECKPOINT_INTERVAL,
+                    stats=stats,
+                    beam_width=beam_width,
+                )
+            except RuntimeError:
+                breaks = None
+            lengths = line_lengths.lengths()
+        entry = (lengths, breaks, {})
+        break_cache[key] = entry
+    return entry
+
+def cached_alternatives(olist, line_lengths, tolerances, emergency_stretch,
+                        beam_width, stats):
+    """Return the line lengths consulted and the best breaks for each
+    number of lines, as compute_breakpoint_alternatives() gives them,
+    for breaking `olist` into lines of `line_lengths`.  They come from
+    break_cache if it has them, and are None if no tolerance admits a
+    solution."""
+
+    key = (olist.digest(), tolerances, emergency_stretch, 'alternatives',
+           beam_width)
+    entry = break_cache.get(key, valid=lambda entry:
+                            line_lengths.matches(entry[0]))
+    if entry is None:
+        try:
+            alternatives = olist.compute_breakpoint_alternatives(
+                line_lengths,
+                tolerance=tolerances,
+                emergency_stretch=emergency_stretch,
+                checkpoint_interval=CHECKPOINT_INTERVAL,
+                stats=stats,
+                beam_width=beam_width,
+            )
+        except RuntimeError:
+            alternatives = None
+        entry = (line_lengths.lengths(), alternatives)
+        break_cache[key] = entry
+    return entry
+
+def beam_width_for(olist):
+    "Return the beam width to break `olist` with, or None for none."
+    return BEAM_WIDTH if len(olist) > BEAM_THRESHOLD else None
+
+def knuth_records(olist, breaks, line_lengths, indent, font_name):
+    """Return a LineRecord for each line of a paragraph broken at
+    `breaks`."""
+
+    assert breaks[0] == 0
+    start = 0
+
+    records = []
+    for i, breakpoint in enumerate(breaks[1:]):
+        record, font_name = knuth_record(olist, start, breakpoint,
+                                         line_lengths[i], indent, font_name)
+        records.append(record)
+        start = breakpoint + 1
+
+    return records
+
+def knuth_record(olist, start, breakpoint, length, indent, font_name):
+    """Return the LineRecord for the line of `length` that sets the items
+    from `start` up to `breakpoint`, and the font in use at its end,
+    given the font in use at its start."""
+
+    r = olist.compute_adjustment_ratio(start, breakpoint, length)
+    record = LineRecord(olist, start, breakpoint, r, indent, font_name)
+
+    kinds = olist.kinds
+    widths = olist.widths
+    for j in range(start, breakpoint):
+        if kinds[j] == BOX and not widths[j]:
+            font_name = olist.character(j)
+
+    return record, font_name
+
+def line_fragments(record):
+    """Return the (x, text) pairs to draw for the line of a LineRecord,
+    where a pair with an x of None switches to the font named by its
+    text."""
+
+    olist, start, breakpoint, r, indent, font_name = record
+    kinds = olist.kinds
+    widths = olist.widths
+    stretches = olist.stretches
+    shrinks = olist.shrinks
+    character = olist.character
+    unit = olist.unit
+
+    xlist = [(None, font_name)]
+    x = 0
+    for j in range(start, breakpoint):
+        kind = kinds[j]
+        if kind == GLUE:
+            if r < 0:
+                x += widths[j] + r * shrinks[j]
+            else:
+                x += widths[j] + r * stretches[j]
+        elif kind == BOX:
+            if widths[j]:
+                xlist.append((x / unit + indent, character(j)))
+                x += widths[j]
+            else:
+                xlist.append((None, character(j)))
+
+    if kinds[breakpoint] == PENALTY and widths[breakpoint]:
+        xlist.append((x / unit + indent, '-'))
+
+    return xlist
+
+def knuth_lines(fonts, line, next_line, indent, first_indent,
+                fonts_and_texts):
+    """Generate the lines of a paragraph set as knuth_paragraph() would
+    set it after `line`, each one as soon as the line breaker is
+    certain of it, so that a long paragraph can start being drawn
+    before it has been broken to the end."""
 
     font_name = fonts_and_texts[0][0]
     font = fonts[font_name]
-    width_of = font.width_of
 
-    leading = max(fonts[name].leading for name, text in fonts_and_texts) * units.pt
-    height = max(fonts[name].height for name, text in fonts_and_texts) * units.pt
+    leading = max(fonts[fragment[0]].leading for fragment in fonts_and_texts) * units.pt
+    height = max(fonts[fragment[0]].height for fragment in fonts_and_texts) * units.pt
 
     line = next_line(line, leading, height)
 
     if first_indent is True:
         first_indent = font.height
 
-    olist = ObjectList()
+    line_lengths = LineLengthCalculator(line,
+                                       lambda l: next_line(l, leading, height),
+                                       getattr(next_line, 'column_width', None),
+                                       SCALED_POINTS)
+
+    # A setting without hyphens is tried in full before anything is
+    # yielded, since it may fail at the very end; unless the paragraph
+    # is so long that the wait would defeat the streaming.
+    breakpoints = None
+    if PRETOLERANCE is not None:
+        olist = cached_object_list(fonts, first_indent, fonts_and_texts,
+                                   hyphenate=False)
+        if len(olist) <= STREAM_PRETOLERANCE_ITEMS:
+            try:
+                breakpoints = iter(olist.compute_breakpoints(
+                    line_lengths, tolerance=PRETOLERANCE,
+                    beam_width=beam_width_for(olist)))
+            except RuntimeError:
+                pass
+
+    if breakpoints is None:
+        olist = cached_object_list(fonts, first_indent, fonts_and_texts)
+        breakpoints = olist.iter_breakpoints(
+            line_lengths,
+            tolerance=TOLERANCES,
+            emergency_stretch=(to_sp(font.height) if SCALED_POINTS
+                               else font.height),
+            beam_width=beam_width_for(olist),
+        )
+
+    start = next(breakpoints)
+    for i, breakpoint in enumerate(breakpoints):
+        if i:
+            line = next_line(line, leading, height)
+        record, font_name = knuth_record(olist, start, breakpoint,
+                                         line_lengths[i], indent, font_name)
+        line.graphics.append((knuth_draw, record))
+        yield line
+        start = breakpoint + 1
+
+def cached_object_list(fonts, first_indent, fonts_and_texts,
+                       hyphenate=True):
+    """Return paragraph_object_list() for a paragraph, reusing the one
+    built for the same text and fonts if it is still in the cache."""
+
+    metrics = tuple(fonts[fragment[0]] for fragment in fonts_and_texts)
+    key = (first_indent, SCALED_POINTS, hyphenate,
+           tuple(tuple(fragment) + (id(font),) for fragment, font
+                 in zip(fonts_and_texts, metrics)))
+    entry = object_lists.get(key)
+    if entry is None:
+        olist = paragraph_object_list(fonts, first_indent, fonts_and_texts,
+                                      hyphenate)
+        entry = object_lists[key] = (metrics, olist)
+    return entry[1]
+
+def paragraph_object_list(fonts, first_indent, fonts_and_texts,
+                          hyphenate=True):
+    """Return an ObjectList of the boxes, glue, and penalties for the
+    words and spaces of a paragraph, in scaled points if SCALED_POINTS
+    is set.  The words are hyphenated if `hyphenate` is true, in the
+    language named by the third item of a (font_name, text, language)
+    fragment, or in the default language for a (font_name, text) pair."""
+
+    size = to_sp if SCALED_POINTS else float
+    width_of = fonts[fonts_and_texts[0][0]].width_of
+
+    olist = ObjectList(scaled=SCALED_POINTS)
     # olist.debug = True
+    add_box = olist.add_box
+    add_glue = olist.add_glue
+    add_penalty = olist.add_penalty
 
     if first_indent:
-        olist.append(Glue(first_indent, 0, 0))
+        add_glue(size(first_indent), 0, 0)
 
     # TODO: get rid of this since it changes with the font?  Compute
     # and pre-cache them in each metrics cache?
     space_width = width_of('m m') - width_of('mm')
 
     # TODO: should do non-breaking spaces with glue as well
-    space_glue = Glue(space_width, space_width * .5, space_width * .3333)
+    space_stretch = space_width * .5
+    space_shrink = space_width * .3333
+    space_glue = size(space_width), size(space_stretch), size(space_shrink)
 
     findall = re.compile(r'([\u00a0]?)(\w*)([^\u00a0\w\s]*)([ \n]*)').findall
 
-    def text_boxes(text):
+    # The length of the list just after its most recent space glue.
+    space_end = None
+
+    def add_text(text, font, language):
+        nonlocal space_end
         #print(repr(text))
-        for control_code, word, punctuation, space in findall(text):
-            #print((control_code, word, punctuation, space))
-            if control_code:
-                if control_code == '\u00a0':
-                    yield Penalty(0, 1000)
-                    yield space_glue
-                else:
-                    print('Unsupported control code: %r' % control_code)
+        tokens = findall(text)
+
+        # Split the words into syllables, then measure every syllable
+        # of the text at once.
+        if hyphenate:
+            pieces = hyphenate_many((word for control_code, word, punctuation,
+                                     space in tokens if word),
+                                    language=language)
+        syllables = []
+        for control_code, word, punctuation, space in tokens:
             if word:
-                strings = hyphenate_word(word)
+                strings = list(pieces[word]) if hyphenate else [word]
                 if punctuation:
                     strings[-1] += punctuation
             elif punctuation:
                 strings = [punctuation]
             else:
                 strings = None
+            syllables.append(strings)
+        widths = iter(widths_of(font, ['-'] + [
+            string for strings in syllables if strings for string in strings
+        ]))
+        hyphen_width = size(next(widths))
+
+        for (control_code, word, punctuation, space), strings in zip(
+                tokens, syllables):
+            #print((control_code, word, punctuation, space))
+            if control_code:
+                if control_code == '\u00a0':
+                    add_penalty(0, 1000)
+                    add_glue(*space_glue)
+                    space_end = len(olist)
+                else:
+                    print('Unsupported control code: %r' % control_code)
             if strings:
                 for i, string in enumerate(strings):
                     if i:
-                        yield Penalty(width_of('-'), 100)
-                    yield Box(width_of(string), string)
+                        add_penalty(hyphen_width, 100)
+                    add_box(size(next(widths)), string)
             if punctuation == '-':
-                yield ZERO_WIDTH_BREAK
+                add_glue(0, 0, 0)
             if space:
-                yield space_glue
+                add_glue(*space_glue)
+                space_end = len(olist)
 
-    for font_name, text in fonts_and_texts:
+    for font_name, text, *language in fonts_and_texts:
         font = fonts[font_name]
-        width_of = font.width_of
-        olist.append(Box(0, font_name))  # special sentinel
-        olist.extend(text_boxes(text))
+        add_box(0, font_name)  # special sentinel
+        add_text(text, font, language[0] if language else None)
 
-    if olist[-1] is space_glue:
+    if space_end == len(olist):
         olist.pop()             # ignore trailing whitespace
 
     olist.add_closing_penalty()
 
-    # line_lengths = [line.column.width]  # TODO: support interesting shapes
-    # indented_lengths = [length - indent for length in line_lengths]
+    return olist
 
-    for tolerance in 1, 2, 3, 4, 5, 6, 7:  # TODO: went to 7 to avoid errors
-        line_lengths = LineLengthCalculator(line,
-                                           lambda l: next_line(l, leading, height))
-        try:
-            breaks = olist.compute_breakpoints(
-                line_lengths,
-                tolerance=tolerance,
-            )
-        except RuntimeError:
-            pass
-        else:
-            break
-    else:
-        print('FAIL')  # TODO
-        breaks = [0, len(olist) - 1]  # TODO
+def knuth_runs(xlist):
+    """Return the fragments of an x-list grouped into runs, as a list of
+    (font_name, [(x, text), ...]) pairs, one for each stretch of the
+    line that is set in a single font."""
 
-    assert breaks[0] == 0
-    start = 0
-
-    font = 'body-roman'
-
-    for i, breakpoint in enumerate(breaks[1:]):
-        r = olist.compute_adjustment_ratio(start, breakpoint, units.as_pt(line.column.width))
-
-        #r = 1.0
-
-        xlist = [(None, font_name)]
-        x = 0
-        for i in range(start, breakpoint):
-            box = olist[i]
-            if box.is_glue():
-                x += box.compute_width(r)
-            elif box.is_box():
-                if box.width:
-                    xlist.append((x + indent, box.character))
-                    x += box.width
-                else:
-                    font_name = box.character
-                    xlist.append((None, font_name))
-
-        bbox = olist[breakpoint]
-        if bbox.is_penalty() and bbox.width:
-            xlist.append((x + indent, '-'))
-
-        line.graphics.append((knuth_draw, xlist))
-        line = next_line(line, leading, height)
-        start = breakpoint + 1
-
-    return a + 1, line.previous
-
-def knuth_draw(fonts, line, painter, xlist):
+    runs = []
+    fragments = None
     for x, text in xlist:
         if x is None:
-            font = fonts[text]
-            painter.setFont(font.qt_font)
+            fragments = []
+            runs.append((text, fragments))
         else:
-            x = x * units.pt
-            y_offset = line.y - font.descent * units.pt
+            fragments.append((x, text))
+    return [run for run in runs if run[1]]
 
-            painter.drawText(units.as_inch(line.column.x + x) * 1200,
-                             units.as_inch(line.column.y + y_offset) * 1200,
-                             text)
+def knuth_draw(fonts, line, painter, record):
+    x0 = units.as_inch(line.column.x) * 1200
+    for font_name, fragments in knuth_runs(line_fragments(record)):
+        font = fonts[font_name]
+        y = units.as_inch(line.column.y + line.y
+                          - font.descent * units.pt) * 1200
+        draw_run(font, painter, x0, y, fragments)
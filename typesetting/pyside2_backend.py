@@ -1,4 +1,17 @@
-from PySide2.QtGui import QFontDatabase
+from PySide2.QtCore import QPointF
+from PySide2.QtGui import QFontDatabase, QFontMetricsF, QTextLayout, QTextOption
+
+try:
+    from PySide2.QtGui import QGlyphRun
+except ImportError:
+    QGlyphRun = None
+
+# Older PySide2 releases, like 5.13, bind neither QGlyphRun nor
+# QTextLayout.glyphRuns(); their fonts draw each fragment with drawText().
+GLYPH_RUNS = QGlyphRun is not None and hasattr(QTextLayout, 'glyphRuns')
+
+from ._cache import LRUCache, MemoizedWidths
+from .glyphs import AdvanceTable
 
 
 def get_fonts(painter, font_specs):
@@ -7,17 +20,73 @@ def get_fonts(painter, font_specs):
         qt_font = QFontDatabase().font(name, style, size)
         painter.setFont(qt_font)
         metrics = painter.fontMetrics()
-        fonts[key] = Font(qt_font, metrics)
+        fonts[key] = Font(qt_font, metrics, painter.device())
     return fonts
 
-class Font(object):
-    def __init__(self, qt_font, metrics):
+class Font(MemoizedWidths):
+    def __init__(self, qt_font, metrics, device=None):
         self.qt_font = qt_font
         self.metrics = metrics
+        self.device = device
         self.ascent = metrics.ascent() * 72 / 1200
         self.descent = metrics.descent() * 72 / 1200
         self.height = metrics.height() * 72 / 1200
         self.leading = metrics.lineSpacing() * 72 / 1200 - self.height
+        self.width_cache = LRUCache(self.width_cache_size)
+        self.glyph_cache = LRUCache(self.width_cache_size)
+
+        # Widths are measured unrounded, in fractions of a device unit.
+        self.float_metrics = QFontMetricsF(metrics)
+
+    def _measure(self, text):
+        return self.float_metrics.horizontalAdvance(text) * 72 / 1200
+
+    def use_advance_table(self):
+        """Measure strings from a table of glyph advances and kerning
+        pairs, filled in as characters are met, instead of asking Qt."""
+        self.advances = AdvanceTable(self.float_metrics.horizontalAdvance,
+                                     72 / 1200)
+
+    def glyphs(self, text):
+        """Return the glyph runs that Qt shapes `text` into, as a list of
+        (QRawFont, glyph indexes, x offsets) triples, with each offset in
+        device units from the start of the text.  A run is split where
+        Qt falls back to another font for some of the characters."""
+        glyphs = self.glyph_cache.get(text)
+        if glyphs is None:
+            layout = QTextLayout(text, self.qt_font, self.device)
+            option = QTextOption()
+            option.setWrapMode(QTextOption.NoWrap)
+            layout.setTextOption(option)
+            layout.beginLayout()
+            layout.createLine()
+            layout.endLayout()
+            glyphs = self.glyph_cache[text] = [
+                (run.rawFont(), run.glyphIndexes(),
+                 [position.x() for position in run.positions()])
+                for run in layout.glyphRuns()
+            ]
+        return glyphs
+
+    def draw_run(self, painter, x0, y, fragments):
+        """Draw the (x, text) `fragments`, with x in points from the
+        device position (x0, y), as one QGlyphRun for each font that
+        Qt shapes them in."""
+        runs = []
+        for x, text in fragments:
+            x = x0 + x * 1200 / 72
+            for raw_font, glyph_indexes, offsets in self.glyphs(text):
+                if not runs or runs[-1][0] != raw_font:
+                    runs.append((raw_font, [], []))
+                raw_font, indexes, positions = runs[-1]
+                indexes.extend(glyph_indexes)
+                positions.extend(QPointF(x + offset, y) for offset in offsets)
+        for raw_font, indexes, positions in runs:
+            run = QGlyphRun()
+            run.setRawFont(raw_font)
+            run.setGlyphIndexes(indexes)
+            run.setPositions(positions)
+            painter.drawGlyphRun(QPointF(0, 0), run)
 
-    def width_of(self, text):
-        return self.metrics.width(text) * 72 / 1200
+    if not GLYPH_RUNS:
+        draw_run = None
@@ -36,6 +36,9 @@ def single_column_layout(width, height, top, bottom, inner, outer):
             column = None
         return Line(line, next_column(column), height, [])
 
+    # Every column is the same width, which lets line breaking treat
+    # the lines of a long paragraph alike.
+    next_line.column_width = column_width
     return next_line
 
 
@@ -64,6 +67,9 @@ def frame_layout(frames, page_width, page_height):
 
         return Line(line, next_column(column), height, [])
 
+    widths = {width for x, y, width, height in frames}
+    if len(widths) == 1:
+        next_line.column_width = widths.pop()
     return next_line
 
 # def new_page():
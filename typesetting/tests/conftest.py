@@ -0,0 +1,10 @@
+import pytest
+
+from .. import hyphenate
+
+@pytest.fixture(autouse=True)
+def trie_cache(monkeypatch, tmp_path):
+    "Keep the tries that tests compile out of the user's cache directory."
+    directory = tmp_path / 'trie-cache'
+    monkeypatch.setattr(hyphenate, 'cache_directory', str(directory))
+    return directory
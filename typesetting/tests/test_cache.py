@@ -0,0 +1,30 @@
+from .._cache import LRUCache
+
+def test_least_recently_used_entry_is_forgotten():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache and len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('c', valid=lambda value: value > 5) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_fonts_measure_each_string_once():
+    from .._cache import MemoizedWidths
+
+    class Font(MemoizedWidths):
+        width_cache_size = 2
+        def __init__(self):
+            self.width_cache = LRUCache(self.width_cache_size)
+            self.measured = []
+        def _measure(self, text):
+            self.measured.append(text)
+            return 5.0 * len(text)
+
+    font = Font()
+    assert font.widths_of(['ab', 'c', 'ab', '']) == [10.0, 5.0, 10.0, 0.0]
+    assert font.width_of('c') == 5.0
+    assert font.measured == ['ab', 'c', '', 'c']
+    assert font.width_cache.hit_rate == 1 / 5
@@ -0,0 +1,163 @@
+from .. import composing, units
+from .._cache import LRUCache
+from ..skeleton import (Column, Line, Page, frame_layout, single_column_layout,
+                        unroll)
+
+pt = units.pt
+
+def paragraph(actions, a, fonts, line, next_line, n, looseness=0):
+    "Set `n` lines, each drawing the index of the action."
+    for i in range(n + looseness):
+        line = next_line(line, 2 * pt, 10 * pt)
+        line.graphics.append(a)
+    return a + 1, line
+
+paragraph.accepts_looseness = True
+
+def layout():
+    return single_column_layout(100 * pt, 58 * pt, 0 * pt, 0 * pt,
+                                0 * pt, 0 * pt)
+
+def describe(start, end):
+    "Describe each line, and whether it shares the previous one's column."
+    lines = unroll(start, end)
+    return [(line.column.id, line.y, line.graphics,
+             previous is not None and line.column is previous.column,
+             previous is not None and line.column.page is previous.column.page)
+            for previous, line in zip(lines, lines[1:])]
+
+def test_lookahead_replays_earlier_results():
+    actions = [
+        (composing.section_title,),
+        (composing.section_title,),
+        (paragraph, 2),
+        (paragraph, 3),
+        (paragraph, 1),
+    ]
+    memo = LRUCache(100)
+    line = composing.run(actions, None, None, layout(), memo)
+    assert memo.hits
+    assert describe(None, line) == describe(
+        None, composing.run(actions, None, None, layout()))
+
+def test_replayed_lines_keep_to_the_column_they_start_in():
+    next_line = layout()
+    actions = [(paragraph, 6)]
+    memo = LRUCache(100)
+    first = next_line(None, 2 * pt, 10 * pt)
+    end = composing.run(actions, None, first, next_line, memo)
+    second = next_line(None, 2 * pt, 10 * pt)
+    end2 = composing.run(actions, None, second, next_line, memo)
+    assert memo.hits == 1
+    assert describe(second, end2) == describe(first, end)
+    lines = unroll(second, end2)
+    assert lines[1].column is second.column
+    assert lines[-1].column is end.column
+
+def test_a_memo_can_be_shared_by_runs():
+    next_line = layout()
+    memo = LRUCache(100)
+    for n in 1, 2, 3, 4, 5:
+        line = composing.run([(paragraph, n)], None, None, next_line, memo)
+        assert len(unroll(None, line)) == n + 1
+    actions = [(paragraph, 2)]
+    for fonts in {'roman': 1}, {'roman': 2}:
+        composing.run(actions, fonts, None, next_line, memo)
+    assert memo.hits == 0
+
+def page_list_layout():
+    "Lay out two frames a page, on pages made up front."
+    pages = [Page(100 * pt, 58 * pt) for i in range(10)]
+    frames = [(0, 0, 100 * pt, 34 * pt), (0, 0, 100 * pt, 58 * pt)]
+
+    def next_column(column):
+        if column is None:
+            page, id = pages[0], 0
+        elif column.id + 1 < len(frames):
+            page, id = column.page, column.id + 1
+        else:
+            n = [i for i, page in enumerate(pages) if page is column.page]
+            page, id = pages[n[0] + 1], 0
+        return Column(page, id, *frames[id])
+
+    def next_line(line, leading, height):
+        if line:
+            y = line.y + height + leading
+            if y <= line.column.height:
+                return Line(line, line.column, y, [])
+        return Line(line, next_column(line and line.column), height, [])
+
+    return next_line
+
+def number_pages(line):
+    "Number the page of each line, in the order the pages first appear."
+    pages = []
+    numbers = []
+    for line in unroll(None, line)[1:]:
+        n = [i for i, page in enumerate(pages) if page is line.column.page]
+        if not n:
+            n = [len(pages)]
+            pages.append(line.column.page)
+        numbers.append(n[0])
+    return numbers
+
+def test_replayed_lines_keep_the_pages_they_were_laid_out_on():
+    actions = [
+        (composing.section_title,),
+        (paragraph, 5),
+        (paragraph, 5),
+        (paragraph, 2),
+        (paragraph, 7),
+    ]
+    frames = [(0, 0, 100 * pt, 34 * pt), (0, 0, 100 * pt, 58 * pt)]
+    for make_layout in page_list_layout, lambda: frame_layout(
+            frames, 100 * pt, 58 * pt):
+        memo = LRUCache(100)
+        line = composing.run(actions, None, None, make_layout(), memo)
+        assert memo.hits
+        expected = composing.run(actions, None, None, make_layout())
+        assert describe(None, line) == describe(None, expected)
+        assert number_pages(line) == number_pages(expected)
+
+def test_overrides_are_part_of_the_layout_key():
+    next_line = layout()
+    line = next_line(None, 2 * pt, 10 * pt)
+    later = next_line(line, 2 * pt, 10 * pt)
+    next_line2 = composing.add_leading(line, next_line, 5 * pt)
+    layout_key = composing.layout_key
+    assert layout_key(line, next_line2) != layout_key(line, next_line)
+    assert layout_key(later, next_line2) == layout_key(later, next_line)
+
+def test_widow_fixed_by_a_tighter_setting():
+    # A paragraph that can be set one line shorter should avoid its
+    # widow that way, rather than by leaving a line empty.
+    line = composing.run([
+        (composing.avoid_widows_and_orphans,),
+        (paragraph, 6),
+    ], None, None, layout())
+    lines = unroll(None, line)[1:]
+    assert [line.column.id for line in lines] == [1] * 5
+    assert [line.y for line in lines] == [y * pt for y in (10, 22, 34, 46, 58)]
+
+def drop_cap_paragraph(actions, a, fonts, line, next_line, n, looseness=0):
+    "Set `n` lines, the first of them taller if the looseness is not zero."
+    line = next_line(line, 2 * pt, (22 if looseness else 10) * pt)
+    line.graphics.append(a)
+    return paragraph(actions, a, fonts, line, next_line, n - 1, looseness)
+
+drop_cap_paragraph.accepts_looseness = True
+
+def test_orphan_fixed_after_a_widow_keeps_the_looseness():
+    # A line longer, the paragraph loses its widow but gains an orphan;
+    # moving it to the next column must keep it a line longer.
+    next_line = layout()
+    line = None
+    for i in range(3):
+        line = next_line(line, 2 * pt, 10 * pt)
+    end = composing.run([
+        (composing.avoid_widows_and_orphans,),
+        (drop_cap_paragraph, 3),
+    ], None, line, next_line)
+    lines = unroll(line, end)[1:]
+    assert len(lines) == 4
+    assert len({id(line.column) for line in lines}) == 1
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from ..glyphs import TOLERANCE, AdvanceTable, widths_of
+from ..textual import naive_wrap
+from ..units import pt
+
+KERNING = {'AV': -1.5, 'VA': -1.5, 'To': -0.75}
+
+def measure(text):
+    "Measure like a font whose shaping is pairwise."
+    width = sum(ord(c) % 7 + 3.1 for c in text)
+    return width + sum(KERNING.get(text[i:i+2], 0)
+                       for i in range(len(text) - 1))
+
+def test_advance_table_matches_the_font():
+    calls = []
+    def counting_measure(text):
+        calls.append(text)
+        return measure(text)
+    table = AdvanceTable(counting_measure, scale=2.0)
+    strings = ['AVA', '', 'To', 'x', 'VAT', 'Tomato', 'AV']
+    assert table.width_of('AVAT') == pytest.approx(2 * measure('AVAT'))
+    asked = len(calls)
+    widths = table.widths_of(strings)
+    assert len(calls) - asked < 20
+    for string, width in zip(strings, widths):
+        assert abs(width / 2 - measure(string)) <= TOLERANCE
+    assert table.max_error(strings) <= TOLERANCE
+
+def test_fonts_without_bulk_measurement_are_measured_one_by_one():
+    class Font:
+        def width_of(self, text):
+            return measure(text)
+    assert widths_of(Font(), ['AV', 'To']) == [measure('AV'), measure('To')]
+    table = AdvanceTable(measure, pt)
+    assert (list(naive_wrap(table, 'To AVA To', 40 * pt))
+            == [['To', 'AVA'], ['To']])
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'fonts',
+                         'GenBasR.ttf')
+
+def test_advance_tables_match_qt_on_real_text(monkeypatch):
+    pytest.importorskip('PySide2')
+    monkeypatch.setenv('QT_QPA_PLATFORM', 'offscreen')
+    from PySide2.QtGui import QFontDatabase, QFontMetricsF, QGuiApplication
+    app = QGuiApplication.instance() or QGuiApplication([])
+    database = QFontDatabase()
+    [family] = database.applicationFontFamilies(
+        database.addApplicationFont(FONT_PATH))
+    width_of = QFontMetricsF(database.font(family, 'Regular', 11)
+                             ).horizontalAdvance
+    strings = ('AVATAR Tomato, Wavy office; affluent T.V. "quoted"'
+               ' To Yves, LTA: typography & kerning.').split()
+    table = AdvanceTable(width_of)
+    widths = table.widths_of(strings)
+    for string, width in zip(strings, widths):
+        assert abs(width - width_of(string)) <= TOLERANCE
+    assert table.max_error(strings) <= TOLERANCE
+
+def test_qt_fonts_draw_lines_with_or_without_glyph_runs(monkeypatch):
+    pytest.importorskip('PySide2')
+    monkeypatch.setenv('QT_QPA_PLATFORM', 'offscreen')
+    from PySide2.QtGui import QFontDatabase, QGuiApplication, QImage, QPainter
+    from .. import pyside2_backend
+    from ..glyphs import draw_run
+    app = QGuiApplication.instance() or QGuiApplication([])
+    database = QFontDatabase()
+    [family] = database.applicationFontFamilies(
+        database.addApplicationFont(FONT_PATH))
+    image = QImage(2000, 400, QImage.Format_RGB32)
+    image.fill(0xffffff)
+    painter = QPainter(image)
+    fonts = pyside2_backend.get_fonts(
+        painter, [('roman', family, 'Regular', 11)])
+    draw_run(fonts['roman'], painter, 0, 200, [(0, 'Tomato'), (40, 'Wavy')])
+    painter.end()
+    assert any(image.pixel(x, y) != image.pixel(0, 0)
+               for x in range(0, 2000, 5) for y in range(0, 400, 5))
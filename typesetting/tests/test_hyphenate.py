@@ -0,0 +1,142 @@
+import random
+import re
+
+import pytest
+
+from .. import hyphenate
+from ..hyphenate import Hyphenator, PackedTrie, hyphenate_word
+
+PATTERNS = '.ab4 a1b b2c 3cab c1a4 .ca2 ab5ca. b3b a2bb1 .c4c cc3a'
+
+def pattern_table(patterns):
+    "Map the letters of each pattern to its points."
+    table = {}
+    for pattern in patterns.split():
+        chars = re.sub('[0-9]', '', pattern)
+        table[chars] = [int(d or 0) for d in re.split('[.a-z]', pattern)]
+    return table
+
+def brute_force_points(table, word):
+    "Look up every substring of `word` in a pattern table, the slow way."
+    points = [0] * (len(word) + 1)
+    for i in range(len(word)):
+        for k in range(i + 1, len(word) + 1):
+            for j, value in enumerate(table.get(word[i:k], ()), i):
+                points[j] = max(points[j], value)
+    return points
+
+def random_words(letters, n):
+    random.seed(0)
+    return ['.' + ''.join(random.choice(letters)
+                          for i in range(random.randint(1, 12))) + '.'
+            for i in range(n)]
+
+def test_packed_trie_applies_every_matching_pattern():
+    trie = PackedTrie.from_patterns(PATTERNS)
+    table = pattern_table(PATTERNS)
+    for word in random_words('abcx', 500):
+        assert trie.points(word) == brute_force_points(table, word)
+
+def test_english_patterns_match_in_one_pass():
+    trie = hyphenate.get_hyphenator().trie
+    table = pattern_table(hyphenate.patterns)
+    words = random_words('eeeettaaoinsrhldcumfpgwybvkxjqz', 2000)
+    words += ['.hyphenation.', '.supercalifragilisticexpialidocious.']
+    for word in words:
+        assert trie.points(word) == brute_force_points(table, word)
+
+def test_packed_trie_is_mapped_back_from_a_file(tmp_path):
+    path = str(tmp_path / 'patterns.trie')
+    PackedTrie.from_patterns(PATTERNS).save(path)
+    trie = PackedTrie.load(path)
+    assert trie.points('.abbcab.') == brute_force_points(
+        pattern_table(PATTERNS), '.abbcab.')
+    assert Hyphenator(trie, 'ab-bc-ab').hyphenate_word('abbcab') == (
+        'ab', 'bc', 'ab')
+    with open(path, 'r+b') as f:
+        f.write(b'not a trie')
+    with pytest.raises(ValueError):
+        PackedTrie.load(path)
+
+def test_english_words_are_hyphenated():
+    assert hyphenate_word('hyphenation') == ('hy', 'phen', 'ation')
+    assert hyphenate_word('project') == ('project',)
+    assert hyphenate_word('naïveté') == ('naïveté',)
+
+def test_each_distinct_word_is_hyphenated_once():
+    hyphenator = Hyphenator(PATTERNS)
+    pieces = hyphenator.hyphenate_many(['cabbage', 'abbca', 'cabbage'])
+    assert pieces == {'cabbage': ('cab', 'b', 'age'), 'abbca': ('abbca',)}
+    assert hyphenator.hyphenate_word('cabbage') is pieces['cabbage']
+    assert (hyphenator.memo.hits, hyphenator.memo.misses) == (1, 2)
+
+def test_large_vocabularies_are_shared_among_processes(monkeypatch):
+    monkeypatch.setattr(hyphenate, 'POOL_THRESHOLD', 3)
+    words = ['hippopotamus', 'dromedary', 'xylophone', 'hippopotamus']
+    pieces = hyphenate.hyphenate_many(words, processes=2)
+    assert pieces == {word: hyphenate_word(word) for word in words}
+
+def test_registered_languages_reach_spawned_workers(monkeypatch):
+    import concurrent.futures
+    import multiprocessing
+    from functools import partial
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', partial(
+        concurrent.futures.ProcessPoolExecutor,
+        mp_context=multiprocessing.get_context('spawn')))
+    monkeypatch.setattr(hyphenate, 'POOL_THRESHOLD', 2)
+    monkeypatch.setattr(hyphenate, 'languages', dict(hyphenate.languages))
+    monkeypatch.setattr(hyphenate, 'hyphenators', {})
+    hyphenate.register_language('xx', PATTERNS)
+    words = ['cabbage', 'abbca', 'cabbca']
+    pieces = hyphenate.hyphenate_many(words, processes=2, language='xx')
+    assert pieces == {word: Hyphenator(PATTERNS).hyphenate_word(word)
+                      for word in words}
+
+def test_compiled_tries_are_cached_by_pattern_text(monkeypatch, tmp_path):
+    monkeypatch.setattr(hyphenate, 'cache_directory', str(tmp_path / 'c'))
+    monkeypatch.setattr(hyphenate, 'tries', {})
+    (tmp_path / 'c').mkdir()
+    (tmp_path / 'c' / 'liangda1-0123456789abcdef0123.trie').write_bytes(b'')
+    built = hyphenate.compiled_trie(PATTERNS)
+    assert hyphenate.compiled_trie(PATTERNS) is built
+    [path] = (tmp_path / 'c').iterdir()
+    assert str(path) == hyphenate.trie_cache_path(PATTERNS)
+    assert hyphenate.trie_cache_path(PATTERNS + ' x1y') != str(path)
+    hyphenate.tries.clear()
+    cached = hyphenate.compiled_trie(PATTERNS)
+    assert isinstance(cached.check, memoryview)
+    assert cached.points('.cabbca.') == built.points('.cabbca.')
+
+    path.write_bytes(b'stale')
+    hyphenate.tries.clear()
+    assert hyphenate.compiled_trie(PATTERNS).points('.cab.') == (
+        built.points('.cab.'))
+    monkeypatch.setattr(hyphenate, 'cache_directory', '')
+    assert hyphenate.trie_cache_path(PATTERNS) is None
+
+TEX_FILE = r"""
+% Patterns for a made-up language.
+\patterns{ % the patterns
+1ä1 .k2
+}
+\hyphenation{
+käk-kä
+}
+"""
+
+def test_languages_are_loaded_from_tex_files_on_first_use(
+        monkeypatch, tmp_path):
+    (tmp_path / 'hyph-xx.tex').write_text(TEX_FILE, encoding='utf-8')
+    monkeypatch.setattr(hyphenate, 'pattern_path', [str(tmp_path)])
+    monkeypatch.setattr(hyphenate, 'languages', {})
+    monkeypatch.setattr(hyphenate, 'hyphenators', {})
+    assert hyphenate.read_tex_patterns(TEX_FILE) == ('1ä1 .k2', 'käk-kä')
+    assert hyphenate_word('sälsärä', 'xx') == ('sä', 'ls', 'ä', 'rä')
+    assert hyphenate_word('käkkä', 'xx') == ('käk', 'kä')
+    assert list(hyphenate.hyphenators) == ['xx']
+    with pytest.raises(LookupError):
+        hyphenate.get_hyphenator('en')
+
+    hyphenate.register_language('yy', path=str(tmp_path / 'hyph-xx.tex'))
+    assert hyphenate.get_hyphenator('yy').trie is (
+        hyphenate.get_hyphenator('xx').trie)
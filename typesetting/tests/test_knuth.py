@@ -0,0 +1,232 @@
+from .. import hyphenate, knuth, units
+from ..skeleton import single_column_layout, unroll
+
+class FakeFont:
+    leading = 2
+    height = 10
+    descent = 2
+
+    def width_of(self, text):
+        return 5.0 * len(text)
+
+FONTS = {'roman': FakeFont()}
+TEXT = (
+    'Writing this summary was difficult, because there were no large'
+    ' themes in the last two weeks of discussion.  Instead there were'
+    ' lots and lots of small items; as the release date for 2.0b1 nears,'
+    ' people are concentrating on resolving outstanding patches, fixing'
+    ' bugs, and making last-minute tweaks.'
+)
+
+def set_paragraph(action, width=200, fonts=FONTS):
+    next_line = single_column_layout(width * units.pt, 1000 * units.pt,
+                                     0 * units.pt, 0 * units.pt,
+                                     0 * units.pt, 0 * units.pt)
+    first = next_line(None, 2 * units.pt, 10 * units.pt)
+    function, *args = action
+    a, last = function([action], 0, fonts, first, next_line, *args)
+    return [line.graphics for line in unroll(first, last)[1:]]
+
+def test_identical_paragraphs_share_break_results():
+    knuth.break_cache.clear()
+    text = [('roman', TEXT)]
+    first = set_paragraph((knuth.knuth_paragraph, 0, True, text))
+    misses = knuth.break_cache.misses
+    second = set_paragraph((knuth.knuth_paragraph, 0, True, list(text)))
+    assert second == first
+    assert knuth.break_cache.hits == knuth.break_cache.misses == misses
+    set_paragraph((knuth.knuth_paragraph, 0, True, text), width=150)
+    assert knuth.break_cache.misses > misses
+
+def test_streamed_lines_match_the_paragraph():
+    text = [('roman', TEXT)]
+    expected = set_paragraph((knuth.knuth_paragraph, 0, True, text))
+    next_line = single_column_layout(200 * units.pt, 1000 * units.pt,
+                                     0 * units.pt, 0 * units.pt,
+                                     0 * units.pt, 0 * units.pt)
+    first = next_line(None, 2 * units.pt, 10 * units.pt)
+    lines = knuth.knuth_lines(FONTS, first, next_line, 0, True, text)
+    assert [line.graphics for line in lines] == expected
+
+def test_every_looseness_is_chosen_from_one_breaking(monkeypatch):
+    knuth.break_cache.clear()
+    breakings = []
+    compute = knuth.ObjectList.compute_breakpoint_alternatives
+    def counting_compute(self, *args, **kwargs):
+        breakings.append(kwargs['tolerance'])
+        return compute(self, *args, **kwargs)
+    monkeypatch.setattr(knuth.ObjectList, 'compute_breakpoint_alternatives',
+                        counting_compute)
+    text = [('roman', TEXT)]
+    settings = {}
+    for looseness in 0, -1, 1:
+        settings[looseness] = set_paragraph(
+            (knuth.knuth_paragraph, 0, True, text, looseness), width=300)
+    assert len(settings[-1]) == len(settings[0]) - 1
+    assert len(settings[1]) == len(settings[0])
+    assert sorted(breakings) == sorted(set(breakings))
+
+def test_long_paragraphs_are_streamed_from_the_first_line(monkeypatch):
+    monkeypatch.setattr(knuth, 'STREAM_PRETOLERANCE_ITEMS', 100)
+    layout = single_column_layout(200 * units.pt, 1000 * units.pt,
+                                  0 * units.pt, 0 * units.pt,
+                                  0 * units.pt, 0 * units.pt)
+    made = []
+    def next_line(line, leading, height):
+        made.append(line)
+        return layout(line, leading, height)
+    next_line.column_width = layout.column_width
+    first = layout(None, 2 * units.pt, 10 * units.pt)
+    text = [('roman', TEXT * 10)]
+    lines = knuth.knuth_lines(FONTS, first, next_line, 0, True, text)
+    next(lines)
+    assert len(made) < 10
+    assert len(list(lines)) > 50
+
+def test_document_stats_gather_every_paragraph(monkeypatch):
+    knuth.break_cache.clear()
+    stats = knuth.DocumentStats(keep=1)
+    monkeypatch.setattr(knuth, 'document_stats', stats)
+    set_paragraph((knuth.knuth_paragraph, 0, True, [('roman', TEXT)]))
+    set_paragraph((knuth.knuth_paragraph, 0, True, [('roman', TEXT[:50])]))
+    set_paragraph((knuth.knuth_paragraph, 0, True, [('roman', TEXT)]))
+    assert stats.total.paragraphs == 2
+    assert stats.cached == 1
+    [(seconds, text, paragraph_stats)] = stats.slowest
+    assert paragraph_stats.seconds == seconds
+
+def test_line_lengths_are_constant_in_a_single_column_layout():
+    next_line = single_column_layout(200 * units.pt, 30 * units.pt,
+                                     0 * units.pt, 0 * units.pt,
+                                     0 * units.pt, 0 * units.pt)
+    first = next_line(None, 2 * units.pt, 10 * units.pt)
+    def next_line2(line):
+        return next_line(line, 2 * units.pt, 10 * units.pt)
+    lengths = knuth.LineLengthCalculator(first, next_line2,
+                                         next_line.column_width)
+    assert lengths.easy_line == 0
+    assert knuth.LineLengthCalculator(first, next_line2).easy_line is None
+
+def test_object_lists_are_built_once_per_text_and_fonts(monkeypatch):
+    monkeypatch.setattr(knuth, 'PRETOLERANCE', None)
+    knuth.object_lists.clear()
+    built = []
+    build = knuth.paragraph_object_list
+    def counting_build(*args):
+        built.append(args)
+        return build(*args)
+    monkeypatch.setattr(knuth, 'paragraph_object_list', counting_build)
+    text = [('roman', TEXT)]
+    set_paragraph((knuth.knuth_paragraph, 0, True, text))
+    set_paragraph((knuth.knuth_paragraph, 0, True, list(text)), width=150)
+    assert len(built) == 1
+    set_paragraph((knuth.knuth_paragraph, 0, True, text),
+                  fonts={'roman': FakeFont()})
+    assert len(built) == 2
+
+def test_hyphenation_waits_until_it_is_needed(monkeypatch):
+    knuth.object_lists.clear()
+    hyphenated = []
+    hyphenate_many = knuth.hyphenate_many
+    def recording_hyphenate_many(words, language=None):
+        words = list(words)
+        hyphenated.extend(words)
+        return hyphenate_many(words, language=language)
+    monkeypatch.setattr(knuth, 'hyphenate_many', recording_hyphenate_many)
+    text = [('roman', TEXT)]
+    wide = set_paragraph((knuth.knuth_paragraph, 0, True, text), width=600)
+    assert not hyphenated
+    assert not any(text == '-' for graphics in wide
+                   for draw, record in graphics
+                   for x, text in knuth.line_fragments(record))
+    set_paragraph((knuth.knuth_paragraph, 0, True, text), width=200)
+    assert hyphenated
+
+def test_fragments_can_name_their_language(monkeypatch):
+    monkeypatch.setattr(hyphenate, 'languages', dict(hyphenate.languages))
+    monkeypatch.setattr(hyphenate, 'hyphenators', {})
+    hyphenate.register_language('xx', '1a1')
+    n = TEXT.index('people')
+    text = [('roman', TEXT[:n]), ('roman', TEXT[n:], 'xx')]
+    graphics = set_paragraph((knuth.knuth_paragraph, 0, True, text),
+                             width=120)
+    fragments = [text for [(draw, record)] in graphics
+                 for x, text in knuth.line_fragments(record) if x is not None]
+    n = fragments.index('people')
+    assert 'a' in fragments[n:] and 'a' not in fragments[:n]
+    assert sorted(hyphenate.hyphenators) == ['en', 'xx']
+
+class RecordingPainter:
+    def __init__(self):
+        self.calls = []
+    def setFont(self, qt_font):
+        self.calls.append(('setFont', qt_font))
+    def drawText(self, x, y, text):
+        self.calls.append(('drawText', text))
+
+class QtFont(FakeFont):
+    qt_font = 'qt'
+
+class RunFont(QtFont):
+    def __init__(self):
+        self.runs = []
+    def draw_run(self, painter, x, y, fragments):
+        self.runs.append([text for x, text in fragments])
+
+def test_lines_are_drawn_as_one_run_per_font():
+    xlist = [(None, 'roman'), (0, 'one'), (20, 'two'), (None, 'bold'),
+             (40, 'three'), (None, 'roman'), (None, 'bold'), (70, 'four')]
+    assert knuth.knuth_runs(xlist) == [
+        ('roman', [(0, 'one'), (20, 'two')]),
+        ('bold', [(40, 'three')]),
+        ('bold', [(70, 'four')]),
+    ]
+    [[(draw, record)], *rest] = set_paragraph(
+        (knuth.knuth_paragraph, 0, True, [('roman', TEXT)]))
+    texts = [text for x, text in knuth.line_fragments(record)
+             if x is not None]
+    next_line = single_column_layout(200 * units.pt, 1000 * units.pt,
+                                     0 * units.pt, 0 * units.pt,
+                                     0 * units.pt, 0 * units.pt)
+    line = next_line(None, 2 * units.pt, 10 * units.pt)
+    font = RunFont()
+    knuth.knuth_draw({'roman': font}, line, RecordingPainter(), record)
+    assert font.runs == [texts]
+    painter = RecordingPainter()
+    knuth.knuth_draw({'roman': QtFont()}, line, painter, record)
+    assert painter.calls == [('setFont', 'qt')] + [('drawText', text)
+                                                    for text in texts]
+
+def test_fragments_wait_until_the_line_is_drawn(monkeypatch):
+    knuth.break_cache.clear()
+    class GlyphFont(RunFont):
+        def glyphs(self, text):
+            return text
+    fonts = {'roman': GlyphFont()}
+    laid_out = []
+    line_fragments = knuth.line_fragments
+    def counting_line_fragments(record):
+        laid_out.append(record)
+        return line_fragments(record)
+    monkeypatch.setattr(knuth, 'line_fragments', counting_line_fragments)
+    [[(draw, record)], *rest] = set_paragraph(
+        (knuth.knuth_paragraph, 0, True, [('roman', TEXT)]), fonts=fonts)
+    assert laid_out == []
+    next_line = single_column_layout(200 * units.pt, 1000 * units.pt,
+                                     0 * units.pt, 0 * units.pt,
+                                     0 * units.pt, 0 * units.pt)
+    line = next_line(None, 2 * units.pt, 10 * units.pt)
+    draw(fonts, line, RecordingPainter(), record)
+    assert laid_out == [record]
+
+def test_lines_are_records_over_the_object_list():
+    knuth.object_lists.clear()
+    graphics = set_paragraph((knuth.knuth_paragraph, 0, True,
+                              [('roman', TEXT)]))
+    records = [record for [(draw, record)] in graphics]
+    assert all(record.olist is records[0].olist for record in records)
+    assert [record.start for record in records[1:]] == [
+        record.end + 1 for record in records[:-1]]
+    first = knuth.line_fragments(records[0])
+    assert first[0] == (None, 'roman')
+    assert all(x is None or x >= 0 for x, text in first)
@@ -0,0 +1,345 @@
+import pytest
+
+from ..texlib.wrap import (
+    BOX, GLUE, PENALTY, INFINITY, Box, Glue, ObjectList, Penalty,
+)
+
+TEXT = (
+    'Writing this summary was difficult, because there were no large'
+    ' themes in the last two weeks of discussion.  Instead there were'
+    ' lots and lots of small items; as the release date for 2.0b1 nears,'
+    ' people are concentrating on resolving outstanding patches, fixing'
+    ' bugs, and making last-minute tweaks.'
+)
+
+def make_paragraph(text=TEXT):
+    olist = ObjectList()
+    for i, word in enumerate(text.split()):
+        if i:
+            olist.add_glue(2, 1, 1)
+        olist.add_box(len(word), word)
+    olist.add_closing_penalty()
+    return olist
+
+def test_items_are_stored_in_columns():
+    olist = ObjectList([Box(3, 'abc'), Glue(2, 1, 1), Penalty(1, 50, 1)])
+    olist.add_box(3, 'abc')
+    assert len(olist) == 4
+    assert list(olist.kinds) == [BOX, GLUE, PENALTY, BOX]
+    assert list(olist.widths) == [3, 2, 1, 3]
+    assert list(olist.characters) == [0, -1, -1, 0]
+    assert olist.strings == ['abc']
+
+def test_items_can_be_retrieved_as_objects():
+    olist = make_paragraph('one two')
+    box, glue, penalty = olist[0], olist[1], olist[-1]
+    assert box.is_box() and box.character == 'one' and box.width == 3
+    assert glue.is_glue() and glue.compute_width(1) == 3
+    assert penalty.is_forced_break()
+    assert olist.pop().penalty == -INFINITY
+    assert len(olist) == 5
+
+def test_breakpoints():
+    olist = make_paragraph()
+    breaks = olist.compute_breakpoints([60], tolerance=2)
+    assert breaks[0] == 0
+    assert breaks[-1] == len(olist) - 1
+    for start, breakpoint in zip(breaks, breaks[1:]):
+        assert olist.is_feasible_breakpoint(breakpoint)
+        r = olist.compute_adjustment_ratio(start, breakpoint, 60)
+        assert -1 <= r <= 2
+
+def total_demerits(olist, breaks, line_length, tolerance):
+    # Score a list of breaks the way compute_breakpoints() does.
+    total = 0
+    fitness_class = 1
+    for start, end in zip(breaks, breaks[1:]):
+        r = olist.compute_adjustment_ratio(start, end, line_length)
+        if not -1 <= r <= tolerance:
+            return None
+        penalty = olist.penalties[end]
+        badness = 1 + 100 * abs(r) ** 3
+        if penalty >= 0:
+            demerits = (badness + penalty) ** 3
+        elif penalty == -INFINITY:
+            demerits = badness ** 2 - penalty ** 2
+        else:
+            demerits = badness ** 2
+        demerits += 100 * olist.flags[end] * olist.flags[start]
+        previous_class, fitness_class = fitness_class, (
+            0 if r < -.5 else 1 if r <= .5 else 2 if r <= 1 else 3)
+        if abs(fitness_class - previous_class) > 1:
+            demerits += 100
+        total += demerits
+    return total
+
+def test_breakpoints_have_least_total_demerits():
+    olist = make_paragraph(TEXT[:90])
+    candidates = [i for i in range(1, len(olist) - 1)
+                  if olist.is_feasible_breakpoint(i)]
+    best = None
+    for mask in range(2 ** len(candidates)):
+        breaks = [0] + [c for j, c in enumerate(candidates) if mask >> j & 1]
+        breaks.append(len(olist) - 1)
+        demerits = total_demerits(olist, breaks, 25, 3)
+        if demerits is not None and (best is None or demerits < best):
+            best = demerits
+    breaks = olist.compute_breakpoints([25], tolerance=3)
+    assert abs(total_demerits(olist, breaks, 25, 3) - best) < 1e-6
+
+def test_tolerances_are_tried_in_turn():
+    olist = make_paragraph()
+    for tolerance in 0.1, 0.2, 0.5, 1, 2, 4:
+        try:
+            expected = olist.compute_breakpoints([40], tolerance=tolerance)
+        except RuntimeError:
+            continue
+        break
+    tolerances = (0.1, 0.2, 0.5, 1, 2, 4)
+    assert olist.compute_breakpoints([40], tolerance=tolerances) == expected
+
+def test_emergency_stretch_never_fails():
+    olist = make_paragraph()
+    try:
+        olist.compute_breakpoints([12], tolerance=(1, 2))
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'expected the paragraph to be impossible to set'
+    breaks = olist.compute_breakpoints([12], tolerance=(1, 2),
+                                       emergency_stretch=4)
+    assert breaks[0] == 0
+    assert breaks[-1] == len(olist) - 1
+
+def test_feasible_breakpoints_are_cached_until_modified():
+    olist = make_paragraph()
+    breakpoints = olist.feasible_breakpoints()
+    assert list(breakpoints) == [i for i in range(len(olist))
+                                 if olist.is_feasible_breakpoint(i)]
+    olist.compute_breakpoints([60], tolerance=2)
+    assert olist.feasible_breakpoints() is breakpoints
+    olist.pop()
+    assert olist.feasible_breakpoints() is not breakpoints
+
+def test_numpy_engine_gives_identical_breakpoints(monkeypatch):
+    pytest.importorskip('numpy')
+    from ..texlib.wrap import _VectorBreaker
+    monkeypatch.setattr(_VectorBreaker, 'min_nodes', 0)
+    olist = make_paragraph(TEXT * 3)
+    for width, tolerance in (25, 2), (40, 1), (60, (0.5, 1, 2)):
+        expected = olist.compute_breakpoints([width], tolerance=tolerance)
+        assert olist.compute_breakpoints([width], tolerance=tolerance,
+                                         engine='numpy') == expected
+    with pytest.raises(ValueError):
+        olist.compute_breakpoints([60], engine='fortran')
+
+def test_items_can_be_replaced_inserted_and_deleted():
+    olist = make_paragraph('one two three')
+    olist.compute_breakpoints([10], tolerance=10)
+    olist[2] = Box(4, 'deux')
+    olist.insert(0, Glue(5, 0, 0))
+    del olist[1:3]
+    assert [item.width for item in olist[:3]] == [5, 4, 2]
+    assert olist.character(1) == 'deux'
+    copy = ObjectList(olist)
+    assert olist.feasible_breakpoints() == copy.feasible_breakpoints()
+    copy.compute_sums()
+    olist.compute_sums()
+    assert olist.sum_width == copy.sum_width
+
+def test_breaking_resumes_from_checkpoints(monkeypatch):
+    from ..texlib.wrap import _Breaker
+    evaluated = []
+    evaluate = _Breaker.evaluate
+    def counting_evaluate(self, i, *args):
+        evaluated.append(i)
+        return evaluate(self, i, *args)
+    monkeypatch.setattr(_Breaker, 'evaluate', counting_evaluate)
+
+    olist = make_paragraph(TEXT * 2)
+    olist.compute_breakpoints([40], tolerance=(1, 2), checkpoint_interval=8)
+    olist[-10] = Box(1, 'x')
+    del evaluated[:]
+    breaks = olist.compute_breakpoints([40], tolerance=(1, 2),
+                                       checkpoint_interval=8)
+    assert min(evaluated) > len(olist) - 40
+    assert breaks == ObjectList(olist).compute_breakpoints([40],
+                                                           tolerance=(1, 2))
+
+    lengths = [40] * 10 + [30]
+    del evaluated[:]
+    breaks = olist.compute_breakpoints(lengths, tolerance=(1, 2),
+                                       checkpoint_interval=8)
+    assert 0 < min(evaluated) < len(olist) - 40
+    assert breaks == ObjectList(olist).compute_breakpoints(lengths,
+                                                           tolerance=(1, 2))
+
+def test_alternatives_are_best_for_each_number_of_lines(monkeypatch):
+    from ..texlib import wrap
+    monkeypatch.setattr(wrap, 'LINE_SPREAD', None)
+    olist = make_paragraph(TEXT[:90])
+    candidates = [i for i in range(1, len(olist) - 1)
+                  if olist.is_feasible_breakpoint(i)]
+    best = {}
+    for mask in range(2 ** len(candidates)):
+        breaks = [0] + [c for j, c in enumerate(candidates) if mask >> j & 1]
+        breaks.append(len(olist) - 1)
+        demerits = total_demerits(olist, breaks, 25, 3)
+        lines = len(breaks) - 1
+        if demerits is not None and (lines not in best
+                                     or demerits < best[lines]):
+            best[lines] = demerits
+    alternatives = olist.compute_breakpoint_alternatives([25], tolerance=3)
+    assert sorted(alternatives) == sorted(best) and len(best) > 1
+    for lines, (demerits, breaks) in alternatives.items():
+        assert len(breaks) - 1 == lines
+        assert abs(demerits - best[lines]) < 1e-6
+        assert abs(total_demerits(olist, breaks, 25, 3) - demerits) < 1e-6
+
+def test_looseness_chooses_a_longer_or_shorter_setting():
+    olist = make_paragraph()
+    alternatives = olist.compute_breakpoint_alternatives([30], tolerance=4)
+    optimum = len(olist.compute_breakpoints([30], tolerance=4)) - 1
+    assert optimum - 1 in alternatives and optimum + 1 in alternatives
+    for looseness in -1, 1:
+        breaks = olist.compute_breakpoints([30], tolerance=4,
+                                           looseness=looseness)
+        assert len(breaks) - 1 == optimum + looseness
+    breaks = olist.compute_breakpoints([30], tolerance=4, looseness=99)
+    assert len(breaks) - 1 == max(alternatives)
+
+class RecordingLengths(list):
+    "Line lengths that remember the last line asked about."
+
+    def __getitem__(self, i):
+        self.last = i
+        return list.__getitem__(self, min(i, len(self) - 1))
+
+def test_breakpoints_are_streamed_once_certain():
+    olist = make_paragraph(TEXT * 3)
+    for width, tolerance in (25, 2), (40, (0.5, 1)), (60, 1):
+        assert (list(olist.iter_breakpoints([width], tolerance=tolerance))
+                == olist.compute_breakpoints([width], tolerance=tolerance))
+    lengths = RecordingLengths([40])
+    breakpoints = olist.iter_breakpoints(lengths, tolerance=0.5)
+    assert next(breakpoints) == 0
+    assert next(breakpoints) > 0
+    assert lengths.last < 5
+    assert len(list(breakpoints)) > 20
+
+def test_breakpoints_are_streamed_while_escalating_tolerances():
+    olist = make_paragraph(TEXT * 10)
+    tolerances = (1, 2, 3, 4, 5, 6, 7)
+    lengths = RecordingLengths([40])
+    breakpoints = olist.iter_breakpoints(lengths, tolerance=tolerances)
+    assert next(breakpoints) == 0
+    assert next(breakpoints) > 0
+    assert lengths.last < 5
+    assert list(breakpoints)[-1] == len(olist) - 1
+    assert (list(olist.iter_breakpoints([40], tolerance=tolerances))
+            == olist.compute_breakpoints([40], tolerance=tolerances))
+
+def test_stats_describe_the_work_done():
+    from ..texlib.wrap import BreakerStats
+    olist = make_paragraph()
+    stats = BreakerStats()
+    olist.compute_breakpoints([40], tolerance=(0.1, 2), stats=stats)
+    olist.compute_breakpoints([40], tolerance=2, stats=stats)
+    assert stats.paragraphs == 2
+    assert stats.items == 2 * len(olist)
+    assert stats.breakpoints == 2 * len(olist.feasible_breakpoints())
+    assert stats.passes == 3
+    assert stats.tolerances == {2: 2}
+    assert 1 <= stats.mean_active <= stats.peak_active
+    assert stats.created >= stats.deactivated > 0
+    assert stats.seconds > 0
+
+def test_nodes_are_merged_once_line_lengths_are_constant():
+    from ..texlib.wrap import BreakerStats, find_easy_line
+    assert find_easy_line([40]) == 0
+    assert find_easy_line([30, 50, 40, 40]) == 2
+    assert find_easy_line(range(40, 50)) is None
+    olist = make_paragraph(TEXT * 3)
+    merged, separate = BreakerStats(), BreakerStats()
+    for lengths in [40], [30, 50, 40, 40]:
+        alternatives = olist.compute_breakpoint_alternatives(
+            lengths, tolerance=2, stats=separate)
+        demerits, expected = min(alternatives.values())
+        assert olist.compute_breakpoints(lengths, tolerance=2,
+                                         stats=merged) == expected
+    assert merged.peak_active < separate.peak_active
+
+def test_active_nodes_stay_few_on_long_paragraphs():
+    from ..texlib.wrap import BreakerStats
+    peaks = []
+    for n in 3, 30:
+        stats = BreakerStats()
+        olist = make_paragraph(TEXT * n)
+        olist.compute_breakpoints([40], tolerance=2, stats=stats)
+        peaks.append(stats.peak_active)
+    assert peaks[0] == peaks[1] < 40
+
+class ConstantLengths:
+    "Line lengths that do not say they are constant."
+    def __getitem__(self, i):
+        return 40
+
+def test_active_nodes_stay_few_without_merging():
+    from ..texlib.wrap import BreakerStats
+    peaks = []
+    for n in 3, 30:
+        stats = BreakerStats()
+        olist = make_paragraph(TEXT * n)
+        olist.compute_breakpoints(ConstantLengths(), tolerance=2, stats=stats)
+        olist.compute_breakpoint_alternatives([40], tolerance=2, stats=stats)
+        peaks.append(stats.peak_active)
+    assert peaks[1] < 2 * peaks[0]
+
+def test_beam_width_bounds_the_active_nodes():
+    from ..texlib.wrap import BreakerStats
+    olist = make_paragraph(TEXT * 6)
+    exact, approximate = BreakerStats(), BreakerStats()
+    alternatives = olist.compute_breakpoint_alternatives([40], tolerance=4,
+                                                         stats=exact)
+    optimum = min(demerits for demerits, breaks in alternatives.values())
+    alternatives = olist.compute_breakpoint_alternatives(
+        [40], tolerance=4, stats=approximate, beam_width=2)
+    demerits = min(demerits for demerits, breaks in alternatives.values())
+    assert exact.pruned == exact.deviation == 0
+    assert approximate.pruned > 0
+    assert approximate.peak_active <= 4 * 2 < exact.peak_active
+    assert optimum <= demerits <= optimum + approximate.deviation
+
+def test_beam_deviation_survives_resuming_from_checkpoints():
+    from ..texlib.wrap import BreakerStats
+    olist = make_paragraph(TEXT * 6)
+    olist.compute_breakpoints([40], tolerance=4, beam_width=2,
+                              checkpoint_interval=8)
+    olist[-10] = Box(1, 'x')
+    resumed, fresh = BreakerStats(), BreakerStats()
+    breaks = olist.compute_breakpoints([40], tolerance=4, beam_width=2,
+                                       checkpoint_interval=8, stats=resumed)
+    assert breaks == ObjectList(olist).compute_breakpoints(
+        [40], tolerance=4, beam_width=2, stats=fresh)
+    assert resumed.pruned < fresh.pruned
+    assert resumed.deviation == fresh.deviation > 0
+
+def test_scaled_points_keep_the_sums_exact():
+    from ..texlib.wrap import SP, to_sp
+    olist = make_paragraph()
+    scaled = ObjectList(scaled=True)
+    for item in olist[:-3]:
+        if item.is_box():
+            scaled.add_box(to_sp(item.width), item.character)
+        else:
+            scaled.add_glue(to_sp(item.width), to_sp(item.stretch),
+                            to_sp(item.shrink))
+    scaled.add_closing_penalty()
+    scaled.compute_sums()
+    olist.compute_sums()
+    assert all(isinstance(total, int) for total in scaled.sum_width)
+    assert scaled.sum_stretch[-1] == to_sp(olist.sum_stretch[-1])
+    assert (scaled.compute_breakpoints([to_sp(40)], tolerance=2)
+            == olist.compute_breakpoints([40], tolerance=2))
+    with pytest.raises(TypeError):
+        scaled.add_box(1.5)
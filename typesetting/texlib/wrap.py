@@ -19,7 +19,9 @@ at a given point.  Positive values discourage line breaks at a given
 point, and a value of INFINITY forbids breaking the line at the
 penalty.  Negative penalty values encourage line breaks at a given
 point, and a value of -INFINITY forces a line break at a particular
-point.
+point.  Internally, an ObjectList keeps its items as parallel typed
+arrays rather than as separate objects, and can be filled directly
+through its add_box(), add_glue(), and add_penalty() methods.
 
 The compute_breakpoints() method of ObjectList returns a list of
 integers containing the indexes at which the paragraph should be
@@ -37,11 +39,30 @@ Reference:
 """
 
 import sys, string
+from array import array
+from hashlib import blake2b
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import accumulate, chain
+from time import perf_counter
 
 __version__ = "1.01"
 
 INFINITY = 1000
 
+# Of the breaks found at one breakpoint, those on lines that are not
+# merged are kept only if their number of lines is within this many of
+# that of the break with the fewest demerits; None keeps them all.  One
+# is enough for a looseness of one either way, as composing asks for.
+LINE_SPREAD = 1
+
+# The number of scaled points in a point, as in TeX.
+SP = 65536
+
+def to_sp(x):
+    "Convert a length in points to a whole number of scaled points."
+    return int(round(x * SP))
+
 # Three classes defining the three different types of object that
 # can go into an ObjectList.
 
@@ -122,40 +143,511 @@ class _BreakNode:
     def __repr__(self):
         return '<_BreakNode at %i>' % self.position
 
-class ObjectList(list):
+class _ActiveNodes:
+    """Internal class holding the set of active breakpoints.
+
+    Nodes are kept in buckets by line number, each bucket being a dict
+    keyed on (position, fitness_class), so that adding, deduplicating,
+    and deactivating a node all take constant time.  Iteration visits
+    the buckets in order of line number, like the sorted active list
+    of the paper, and the nodes of a bucket in the order they arrived.
+
+    A node's demerits are the total for the lines leading up to it, so
+    of two nodes with the same key the one with fewer demerits is kept.
+    Without merging, a node is kept for every number of lines by which
+    a breakpoint can be reached, and on a long paragraph the set would
+    grow with its length; compute_breakpoints() merges whenever the
+    line lengths allow it, and otherwise the main loop keeps only the
+    numbers of lines within LINE_SPREAD of the best at each breakpoint.
+
+    If 'easy_line' is given, every line from that one on has the same
+    length, so a node's line number past it makes no difference to how
+    the paragraph can continue.  Such nodes share the bucket for
+    'easy_line', and only the best one at each position and fitness
+    class is kept, as TeX does.  The best setting for each number of
+    lines is then lost, but not the best setting overall.
+    """
+
+    def __init__(self, nodes = (), easy_line = None):
+        self.easy_line = easy_line
+        self._buckets = {}
+        self._lines = []                # Sorted line numbers in use
+        self._count = 0
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for line in self._lines:
+            yield from self._buckets[line].values()
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def add(self, node):
+        """Add a node, unless a node with the same line, position, and
+        fitness class is already active with no more demerits."""
+
+        line = self._bucket_line(node)
+        bucket = self._buckets.get(line)
+        if bucket is None:
+            bucket = self._buckets[line] = {}
+            insort(self._lines, line)
+        key = (node.position, node.fitness_class)
+        other = bucket.get(key)
+        if other is None:
+            bucket[key] = node
+            self._count += 1
+            self._inserted(node, None)
+        elif node.demerits < other.demerits:
+            bucket[key] = node
+            self._inserted(node, other)
+
+    def remove(self, node):
+        "Deactivate a node."
+
+        line = self._bucket_line(node)
+        bucket = self._buckets[line]
+        del bucket[node.position, node.fitness_class]
+        self._count -= 1
+        if not bucket:
+            del self._buckets[line]
+            del self._lines[bisect_left(self._lines, line)]
+        self._removed(node)
+
+    def _bucket_line(self, node):
+        "Return the line number of the bucket that holds 'node'."
+        easy_line = self.easy_line
+        if easy_line is not None and node.line > easy_line:
+            return easy_line
+        return node.line
+
+    # Hooks for subclasses that keep extra per-node state.
+
+    def _inserted(self, node, replaced):
+        pass
+
+    def _removed(self, node):
+        pass
+
+class _ActiveArrays(_ActiveNodes):
+    """Internal class holding the set of active breakpoints, mirrored
+    into NumPy arrays for the vectorized engine.
+
+    Each node occupies a slot of the 'position', 'line',
+    'fitness_class', and 'demerits' arrays until it is deactivated.
+    The 'bucket' array holds the line number of each node's bucket, and
+    the 'seq' array the order in which the nodes arrived, so that
+    sorting the live slots by (bucket, seq) gives the same order as
+    iterating over the set.
+    """
+
+    _fields = ('position', 'line', 'bucket', 'fitness_class', 'demerits',
+               'seq', 'alive')
+
+    def __init__(self, numpy, nodes = (), easy_line = None):
+        self.numpy = numpy
+        self.nodes = []                 # Node in each slot, or None
+        self._free = []
+        self._slots = {}
+        self._seq = 0
+        self.position = numpy.zeros(64, numpy.int64)
+        self.line = numpy.zeros(64, numpy.int64)
+        self.bucket = numpy.zeros(64, numpy.int64)
+        self.fitness_class = numpy.zeros(64, numpy.int64)
+        self.demerits = numpy.zeros(64)
+        self.seq = numpy.zeros(64, numpy.int64)
+        self.alive = numpy.zeros(64, bool)
+        _ActiveNodes.__init__(self, nodes, easy_line)
+
+    def _grow(self):
+        for name in self._fields:
+            old = getattr(self, name)
+            new = self.numpy.zeros(2 * len(old), old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _inserted(self, node, replaced):
+        line = self._bucket_line(node)
+        key = (line, node.position, node.fitness_class)
+        if replaced is not None:
+            # The replacement keeps the old node's place in the order,
+            # though it may be on a different line past 'easy_line'.
+            slot = self._slots[key]
+            self.line[slot] = node.line
+        else:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self.nodes)
+                self.nodes.append(None)
+                if slot == len(self.alive):
+                    self._grow()
+            self._slots[key] = slot
+            self.position[slot] = node.position
+            self.line[slot] = node.line
+            self.bucket[slot] = line
+            self.fitness_class[slot] = node.fitness_class
+            self.seq[slot] = self._seq
+            self.alive[slot] = True
+            self._seq += 1
+        self.nodes[slot] = node
+        self.demerits[slot] = node.demerits
+
+    def _removed(self, node):
+        slot = self._slots.pop((self._bucket_line(node), node.position,
+                                node.fitness_class))
+        self.nodes[slot] = None
+        self.alive[slot] = False
+        self._free.append(slot)
+
+    def live_slots(self):
+        "Return the slots of the active nodes in iteration order."
+        numpy = self.numpy
+        slots = numpy.flatnonzero(self.alive[:len(self.nodes)])
+        order = numpy.lexsort((self.seq[slots], self.bucket[slots]))
+        return slots[order]
+
+class BreakerStats:
+    """Counts describing the work done to break one or more paragraphs.
+
+    Pass an instance as the 'stats' argument of compute_breakpoints()
+    to have it filled in; add() sums the counts of another instance
+    into this one.
+
+    paragraphs : the number of paragraphs broken.
+    items : the number of items in them.
+    breakpoints : the number of feasible breakpoints among the items.
+    evaluations : the number of breakpoints evaluated, over all passes.
+    active : the total number of active nodes at each evaluation, so
+             that mean_active is the average.
+    peak_active : the largest number of active nodes at once.
+    created : the number of feasible breaks found, each one a new
+              active node unless an equivalent one had fewer demerits.
+    deactivated : the number of active nodes deactivated.
+    pruned : the number of active nodes dropped to keep within the
+             beam width; see compute_breakpoints().
+    deviation : the most by which the demerits of the settings chosen
+                may exceed the optimum, summed over the paragraphs.
+                Zero unless nodes were pruned.
+    passes : the number of passes run.
+    tolerances : a Counter of the tolerance of the pass that succeeded
+                 for each paragraph, None meaning the emergency pass.
+    seconds : the wall time spent.
+    """
+
+    def __init__(self):
+        self.paragraphs = 0
+        self.items = 0
+        self.breakpoints = 0
+        self.evaluations = 0
+        self.active = 0
+        self.peak_active = 0
+        self.created = 0
+        self.deactivated = 0
+        self.pruned = 0
+        self.deviation = 0.0
+        self.passes = 0
+        self.tolerances = Counter()
+        self.seconds = 0.0
+
+    @property
+    def mean_active(self):
+        if not self.evaluations:
+            return 0.0
+        return self.active / self.evaluations
+
+    def add(self, other):
+        "Add the counts of 'other' to this instance."
+        for name in ('paragraphs', 'items', 'breakpoints', 'evaluations',
+                     'active', 'created', 'deactivated', 'pruned',
+                     'deviation', 'passes', 'seconds'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.peak_active = max(self.peak_active, other.peak_active)
+        self.tolerances.update(other.tolerances)
+
+    def __repr__(self):
+        return ('<BreakerStats paragraphs={} items={} breakpoints={}'
+                ' evaluations={} mean_active={:.1f} peak_active={}'
+                ' created={} deactivated={} pruned={} deviation={}'
+                ' passes={} tolerances={} seconds={:.6f}>'.format(
+                    self.paragraphs, self.items, self.breakpoints,
+                    self.evaluations, self.mean_active, self.peak_active,
+                    self.created, self.deactivated, self.pruned,
+                    self.deviation, self.passes, dict(self.tolerances),
+                    self.seconds))
+
+# The kinds of item, as stored in the 'kinds' column of an ObjectList.
+BOX, GLUE, PENALTY = 0, 1, 2
+
+class ObjectList:
 
     """Class representing a list of Box, Glue, and Penalty objects.
-    Supports the same methods as regular Python lists.
+
+    Instead of holding one Python object per item, the list stores its
+    items column by column in typed arrays: 'kinds' holds BOX, GLUE, or
+    PENALTY for each item; 'widths', 'stretches', 'shrinks', and
+    'penalties' hold its numeric values; 'flags' holds its flagged bit;
+    and 'characters' holds an index into the 'strings' table, or -1 for
+    items that carry no text.  Use add_box(), add_glue(), and
+    add_penalty() to append items without building objects at all.
+
+    If 'scaled' is true, the widths, stretches, and shrinks are integers
+    in scaled points (see to_sp()), held in integer arrays, so that the
+    running sums are exact and the same items always break the same
+    way, to the last bit.  The line lengths and emergency stretch given
+    to compute_breakpoints() must then be in scaled points as well.
+    The 'unit' attribute is the size of a point in the list's units.
+
+    Supports the basic methods of regular Python lists, building Box,
+    Glue, and Penalty instances on the fly when items are retrieved.
     """
 
     # Set this to 1 to trace the execution of the algorithm.
     debug = 0
 
+    def __init__(self, items = (), scaled = False):
+        typecode = 'q' if scaled else 'd'
+        self.scaled = scaled
+        self.unit = SP if scaled else 1
+        self.kinds = array('b')
+        self.widths = array(typecode)
+        self.stretches = array(typecode)
+        self.shrinks = array(typecode)
+        self.penalties = array('d')
+        self.flags = array('b')
+        self.characters = array('l')
+        self.strings = []
+        self._string_indexes = {}
+        self.sum_width = self.sum_stretch = self.sum_shrink = None
+        self._breakpoints = None
+        self._breakpoints_end = 0
+        self._digest = None
+        self._changed = 0               # First item changed since a
+        self._resume = None             # checkpointed run, and its state
+        self.extend(items)
+
+    def _columns(self):
+        return (self.kinds, self.widths, self.stretches, self.shrinks,
+                self.penalties, self.flags, self.characters)
+
+    def _invalidate(self, start):
+        """Forget everything precomputed from the items at position
+        'start' onward, which have changed."""
+        if start < self._changed:
+            self._changed = start
+        self._digest = None
+        if self.sum_width is not None:
+            del self.sum_width[start+1:]
+            del self.sum_stretch[start+1:]
+            del self.sum_shrink[start+1:]
+        breakpoints = self._breakpoints
+        if breakpoints is not None and start < self._breakpoints_end:
+            # Whether 'i' is a feasible breakpoint depends on the items
+            # at 'i' and 'i-1'.
+            if breakpoints and breakpoints[-1] >= start:
+                self._breakpoints = breakpoints[:bisect_left(breakpoints,
+                                                             start)]
+            self._breakpoints_end = start
+
+    def _intern(self, string):
+        "Return the index of 'string' in the string table."
+        if string is None:
+            return -1
+        index = self._string_indexes.get(string)
+        if index is None:
+            index = self._string_indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def _add(self, kind, width, stretch, shrink, penalty, flagged,
+             character):
+        self.kinds.append(kind)
+        self.widths.append(width)
+        self.stretches.append(stretch)
+        self.shrinks.append(shrink)
+        self.penalties.append(penalty)
+        self.flags.append(flagged)
+        self.characters.append(self._intern(character))
+        self._invalidate(len(self.kinds) - 1)
+
+    def add_box(self, width, character = None):
+        "Append a box of the given width."
+        self._add(BOX, width, 0, 0, 0, 0, character)
+
+    def add_glue(self, width, stretch, shrink):
+        "Append glue with the given width, stretch, and shrink."
+        self._add(GLUE, width, stretch, shrink, 0, 0, None)
+
+    def add_penalty(self, width, penalty, flagged = 0):
+        "Append a penalty."
+        self._add(PENALTY, width, 0, 0, penalty, flagged, None)
+
     def add_closing_penalty (self):
         "Add the standard glue and penalty for the end of a paragraph"
-        self.append( Penalty( 0, INFINITY, 0 ) )
-        self.append( Glue(0, INFINITY, 0) )
-        self.append( Penalty(0, -INFINITY, 1) )
+        self.add_penalty(0, INFINITY, 0)
+        self.add_glue(0, INFINITY * self.unit, 0)
+        self.add_penalty(0, -INFINITY, 1)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        kind = self.kinds[i]
+        if kind == BOX:
+            character = self.characters[i]
+            if character >= 0:
+                character = self.strings[character]
+            else:
+                character = None
+            return Box(self.widths[i], character)
+        elif kind == GLUE:
+            return Glue(self.widths[i], self.stretches[i], self.shrinks[i])
+        else:
+            return Penalty(self.widths[i], self.penalties[i], self.flags[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, item):
+        "Append a Box, Glue, or Penalty instance."
+        if item.is_box():
+            self.add_box(item.width, getattr(item, 'character', None))
+        elif item.is_glue():
+            self.add_glue(item.width, item.stretch, item.shrink)
+        else:
+            self.add_penalty(item.width, item.penalty, item.flagged)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __setitem__(self, i, items):
+        """Replace the item at position 'i' with another, or the items
+        in the slice 'i' with a sequence of others."""
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError('extended slices are not supported')
+            stop = max(start, stop)
+        else:
+            start = range(len(self))[i]
+            stop = start + 1
+            items = [items]
+        new = ObjectList(items, self.scaled)
+        characters = array('l', [self._intern(new.strings[index])
+                                 if index >= 0 else -1
+                                 for index in new.characters])
+        columns = new._columns()[:-1] + (characters,)
+        for column, values in zip(self._columns(), columns):
+            column[start:stop] = values
+        self._invalidate(start)
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            self[i] = []
+        else:
+            i = range(len(self))[i]
+            self[i:i+1] = []
+
+    def insert(self, i, item):
+        "Insert a Box, Glue, or Penalty instance before position 'i'."
+        self[i:i] = [item]
+
+    def pop(self):
+        "Remove and return the last item."
+        item = self[-1]
+        for column in self._columns():
+            column.pop()
+        self._invalidate(len(self))
+        return item
+
+    def digest(self):
+        """Return a digest of every item in the list, as bytes.  Lists
+        with the same items have the same digest, so it can serve to
+        look up results computed from them."""
+        if self._digest is None:
+            h = blake2b(digest_size=20)
+            h.update(self.widths.typecode.encode('ascii'))
+            for column in self._columns():
+                h.update(column.tobytes())
+            for string in self.strings:
+                h.update(string.encode('utf-8', 'surrogatepass') + b'\0')
+            self._digest = h.digest()
+        return self._digest
+
+    def character(self, i):
+        "Return the text of the item at position 'i', or None."
+        index = self.characters[i]
+        return self.strings[index] if index >= 0 else None
 
     def is_feasible_breakpoint(self, i):
         "Return true if position 'i' is a feasible breakpoint."
 
-        box = self[i]
-        if box.is_penalty() and box.penalty < INFINITY:
-            return 1
-        elif i>0 and box.is_glue() and self[i-1].is_box():
-            return 1
-        else:
-            return 0
+        kind = self.kinds[i]
+        if kind == PENALTY:
+            return self.penalties[i] < INFINITY
+        return kind == GLUE and i > 0 and self.kinds[i-1] == BOX
+
+    def feasible_breakpoints(self):
+        """Return an array of the positions of every feasible breakpoint,
+        in increasing order.  The array is kept until the list is next
+        modified, and after a change only the breakpoints from the
+        first changed item onward are found again.
+        """
+        start = self._breakpoints_end
+        if self._breakpoints is None or start < len(self):
+            kinds = self.kinds
+            penalties = self.penalties
+            previous_kinds = chain((kinds[start-1] if start else None,),
+                                   kinds[start:])
+            found = array('l', [
+                i for i, kind, previous_kind
+                in zip(range(start, len(self)), kinds[start:], previous_kinds)
+                if (penalties[i] < INFINITY if kind == PENALTY
+                    else kind == GLUE and previous_kind == BOX)
+            ])
+            if self._breakpoints is not None:
+                found = self._breakpoints + found
+            self._breakpoints = found
+            self._breakpoints_end = len(self)
+        return self._breakpoints
 
     def is_forced_break(self, i):
         "Return true if position 'i' is a forced breakpoint."
 
-        box = self[i]
-        if box.is_penalty() and box.penalty == -INFINITY:
-            return 1
-        else:
-            return 0
+        return self.kinds[i] == PENALTY and self.penalties[i] == -INFINITY
+
+    def compute_sums(self):
+        """Precompute the running sums of width, stretch, and shrink.
+
+        These are W, Y, and Z in the original paper, and make it easy to
+        measure the width/stretch/shrink between two indexes; just
+        compute sum_*[pos2] - sum_*[pos1].  Note that sum_*[i] is the
+        total up to but not including the item at position i.  The sums
+        are kept when the list is modified, up to the first changed
+        item, and extended from there.
+        """
+        if self.sum_width is None:
+            typecode = self.widths.typecode
+            self.sum_width = array(typecode, [0])
+            self.sum_stretch = array(typecode, [0])
+            self.sum_shrink = array(typecode, [0])
+        start = len(self.sum_width) - 1
+        if start == len(self):
+            return
+        widths = (0 if kind == PENALTY else width
+                  for kind, width in zip(self.kinds[start:],
+                                         self.widths[start:]))
+        for sums, values in ((self.sum_width, widths),
+                             (self.sum_stretch, self.stretches[start:]),
+                             (self.sum_shrink, self.shrinks[start:])):
+            sums.extend(accumulate(values, initial=sums.pop()))
 
     def measure_width(self, pos1, pos2):
         "Add up the widths between positions 1 and 2"
@@ -172,10 +664,15 @@ class ObjectList(list):
 
         return self.sum_shrink[pos2] - self.sum_shrink[pos1]
 
-    def compute_adjustment_ratio(self, pos1, pos2, available_length):
-        "Compute adjustment ratio for the line between pos1 and pos2"
+    def compute_adjustment_ratio(self, pos1, pos2, available_length,
+                                 extra_stretch = 0):
+        """Compute adjustment ratio for the line between pos1 and pos2,
+        optionally pretending that it has 'extra_stretch' more stretch.
+        The main loop does the same arithmetic inline.
+        """
+        self.compute_sums()
         length = self.measure_width(pos1, pos2)
-        if self[pos2].is_penalty(): length += self[pos2].width
+        if self.kinds[pos2] == PENALTY: length += self.widths[pos2]
         if self.debug:
             print('\tline length=', length)
 
@@ -186,7 +683,7 @@ class ObjectList(list):
         # Compute how much the contents of the line would have to be
         # stretched or shrunk to fit into the available space.
         if length < available_length:
-            y = self.measure_stretch(pos1, pos2)
+            y = self.measure_stretch(pos1, pos2) + extra_stretch
             if self.debug:
                 print ('\tLine too short: shortfall = %i, stretch = %i'
                        % (available_length - length, y) )
@@ -211,46 +708,18 @@ class ObjectList(list):
         return r
 
 
-    def add_active_nodes(self, active_nodes, nodes):
-        """Add nodes to the active node list.
-        The nodes are added so that the list of active nodes is always
-        sorted by line number, and so that the set of (position, line,
-        fitness_class) tuples has no repeated values.
-        """
-
-        for node in nodes:
-            index = 0
-
-            # Find the first index at which the active node's line number
-            # is equal to or greater than the line for 'node'.  This gives
-            # us the insertion point.
-            while (index < len(active_nodes) and
-                   active_nodes[index].line < node.line):
-                index = index + 1
-
-            insert_index = index
-
-            # Check if there's a node with the same line number and
-            # position and fitness.  This lets us ensure that the list of
-            # active nodes always has unique (line, position, fitness)
-            # values.
-            while (index < len(active_nodes) and
-                   active_nodes[index].line == node.line):
-                if (active_nodes[index].fitness_class == node.fitness_class and
-                    active_nodes[index].position == node.position):
-                    # A match, so just return without adding the node
-                    return
-
-                index = index + 1
-
-            active_nodes.insert(insert_index, node)
-
     def compute_breakpoints(self,
                             line_lengths,
                             looseness = 0,  # q in the paper
                             tolerance = 1,  # rho in the paper
                             fitness_demerit = 100, # gamma (XXX?) in the paper
                             flagged_demerit = 100, # alpha in the paper
+                            emergency_stretch = None,
+                            breakpoints = None,
+                            engine = 'python',
+                            checkpoint_interval = None,
+                            stats = None,
+                            beam_width = None,
                             ):
         """Compute a list of optimal breakpoints for the paragraph
         represented by this ObjectList, returning them as a list of
@@ -258,246 +727,984 @@ class ObjectList(list):
 
         line_lengths : a list of integers giving the lengths of each
                        line.  The last element of the list is reused
-                       for subsequent lines.
+                       for subsequent lines.  Another sequence may
+                       give the index of the line from which every
+                       length is the same as an 'easy_line' attribute,
+                       which lets nodes past it be merged when the
+                       looseness is zero.
         looseness : An integer value. If it's positive, the paragraph
                    will be set to take that many lines more than the
-                   optimum value.   If it's negative, the paragraph is
-                   set as tightly as possible.  Defaults to zero,
-                   meaning the optimal length for the paragraph.
+                   optimum value, or as many more as the tolerance
+                   allows.   If it's negative, the paragraph is set
+                   that many lines shorter, or as tightly as possible.
+                   Defaults to zero, meaning the optimal length for
+                   the paragraph.  See choose_line_count().
         tolerance : the maximum adjustment ratio allowed for a line.
-                    Defaults to 1.
+                    Defaults to 1.  May also be a sequence of increasing
+                    tolerances, which are tried in turn until one of
+                    them admits a solution, like TeX's pretolerance and
+                    tolerance passes.
         fitness_demerit : additional value added to the demerit score
                           when two consecutive lines are in different
                           fitness classes.
         flagged_demerit : additional value added to the demerit score
                           when breaking at the second of two flagged
                           penalties.
+        emergency_stretch : if not None, and no tolerance admits a
+                            solution, a final pass at the last
+                            tolerance gives every line this much extra
+                            stretch and accepts an overfull line rather
+                            than fail.  If None, RuntimeError is raised
+                            instead.
+        breakpoints : an increasing sequence of the positions at which
+                      breaks may be considered.  Defaults to every
+                      feasible breakpoint of the list.
+        engine : 'python', or 'numpy' to evaluate the lines ending at
+                 each breakpoint as NumPy array operations, which pays
+                 off once there are many active nodes.  Both engines
+                 return exactly the same breakpoints.
+        checkpoint_interval : if given, the state of the main loop is
+                              saved every this many breakpoints and kept
+                              with the list.  The next call that is
+                              given the same interval and parameters
+                              then resumes from the last checkpoint
+                              before the first item changed in the
+                              meantime, and before the first line whose
+                              length has changed, rather than starting
+                              over.  Ignored if 'breakpoints' is given.
+        stats : a BreakerStats instance to add the counts for this
+                paragraph to.
+        beam_width : if given, after each breakpoint only this many of
+                     the active nodes with the fewest demerits are kept
+                     in each fitness class, which bounds the work per
+                     breakpoint for very long paragraphs at the risk of
+                     missing the optimum.  The most by which the
+                     result's demerits may exceed the optimum is added
+                     to the 'deviation' of 'stats'.
+        """
+
+        if len(self) == 0: return []    # No text, so no breaks
+
+        # With no looseness, only the best setting overall matters, so
+        # the nodes past the point where the line length stops changing
+        # can be merged.
+        breaker = self._run(line_lengths, tolerance, fitness_demerit,
+                            flagged_demerit, emergency_stretch,
+                            breakpoints, engine, checkpoint_interval,
+                            stats, beam_width, merge = not looseness)
+        if not looseness:
+            A = min(breaker.active_nodes, key=lambda A: A.demerits)
+            demerits, breaks = A.demerits, _path(A)
+        else:
+            alternatives = _alternatives(breaker.active_nodes)
+            demerits, breaks = alternatives[
+                choose_line_count(alternatives, looseness)]
+        if stats is not None:
+            stats.deviation += breaker.deviation(demerits)
+        return breaks
+
+    def compute_breakpoint_alternatives(self,
+                                        line_lengths,
+                                        tolerance = 1,
+                                        fitness_demerit = 100,
+                                        flagged_demerit = 100,
+                                        emergency_stretch = None,
+                                        breakpoints = None,
+                                        engine = 'python',
+                                        checkpoint_interval = None,
+                                        stats = None,
+                                        beam_width = None,
+                                        ):
+        """Compute the optimal breakpoints for every number of lines
+        that the paragraph can be set in, up to LINE_SPREAD lines away
+        from the optimum at each breakpoint, in a single run of the main
+        loop.  Return a dict mapping each number of lines, in increasing
+        order, to a (demerits, breakpoints) pair, where breakpoints is a
+        list like the one compute_breakpoints() returns.
+
+        The arguments are the same as for compute_breakpoints().  With
+        a beam width, the 'deviation' added to 'stats' is the bound for
+        the alternative with the fewest demerits.
         """
 
+        if len(self) == 0: return {}    # No text, so no breaks
+
+        breaker = self._run(line_lengths, tolerance, fitness_demerit,
+                            flagged_demerit, emergency_stretch,
+                            breakpoints, engine, checkpoint_interval,
+                            stats, beam_width, merge = False)
+        alternatives = _alternatives(breaker.active_nodes)
+        if stats is not None:
+            demerits = min(demerits for demerits, breaks
+                           in alternatives.values())
+            stats.deviation += breaker.deviation(demerits)
+        return alternatives
+
+    def _run(self, line_lengths, tolerance, fitness_demerit,
+             flagged_demerit, emergency_stretch, breakpoints, engine,
+             checkpoint_interval, stats, beam_width, merge):
+        """Run the main loop and return the breaker, holding the active
+        nodes left at the end.  If 'merge' is true, nodes on lines past
+        the point where the line length becomes constant are merged."""
+
         m = len(self)
-        if m == 0: return []            # No text, so no breaks
-
-        # Precompute lists containing the numeric values for each box.
-        # The variable names follow those in Knuth's description.
-        w = [0]*m ;
-        y = [0]*m ; z = [0]*m
-        p = [0]*m ; f = [0]*m
-        for i in range(m):
-            box = self[i]
-            w[i] = box.width
-            if box.is_glue():
-                y[i] = box.stretch
-                z[i] = box.shrink
-            elif box.is_penalty():
-                p[i] = box.penalty
-                f[i] = box.flagged
-
-        # Precompute the running sums of width, stretch, and shrink
-        # (W,Y,Z in the original paper).  These make it easy to measure the
-        # width/stretch/shrink between two indexes; just compute
-        # sum_*[pos2] - sum_*[pos1].  Note that sum_*[i] is the total
-        # up to but not including the box at position i.
-
-        self.sum_width = [0] * m
-        self.sum_stretch = [0] * m
-        self.sum_shrink = [0] * m
-        width_sum = stretch_sum = shrink_sum = 0
-        for i in range(m):
-            self.sum_width[i] = width_sum
-            self.sum_stretch[i] = stretch_sum
-            self.sum_shrink[i] = shrink_sum
-
-            box = self[i]
-            if not box.is_penalty():
-                width_sum   = width_sum + box.width
-                stretch_sum = stretch_sum + box.stretch
-                shrink_sum  = shrink_sum + box.shrink
+        if stats is not None:
+            started = perf_counter()
+        if breakpoints is not None:
+            checkpoint_interval = None
+        breaker = self._breaker(line_lengths, tolerance, fitness_demerit,
+                                flagged_demerit, emergency_stretch,
+                                breakpoints, engine, merge)
+        breaker.stats = stats
+        breaker.beam_width = beam_width
+        if checkpoint_interval:
+            settings = (type(breaker), breaker.tolerances, fitness_demerit,
+                        flagged_demerit, emergency_stretch,
+                        checkpoint_interval, breaker.easy_line, beam_width)
+            breaker.checkpoint_interval = checkpoint_interval
+            if self._resume is not None and self._resume[0] == settings:
+                breaker.previous = self._resume[1]
+                breaker.changed = self._changed
+            active_nodes = breaker.run()
+            breaker.previous = None
+            self._resume = (settings, breaker)
+            self._changed = m
+        else:
+            active_nodes = breaker.run()
 
-        # Initialize list of active nodes to a single break at the
-        # beginning of the text.
-        A = _BreakNode(position=0, line=0, fitness_class = 1,
-                 totalwidth = 0, totalstretch = 0,
-                 totalshrink = 0, demerits = 0)
-        active_nodes = [A]
+        if stats is not None:
+            stats.paragraphs += 1
+            stats.items += m
+            stats.breakpoints += len(breaker.breakpoints)
+            stats.seconds += perf_counter() - started
 
         if self.debug:
-            print('Looping over %i box objects' % m)
-
-        for i in range(m):
-            B = self[i]
-            #print(B, getattr(B, 'character', None))
-            # Determine if this box is a feasible breakpoint and
-            # perform the main loop if it is.
-            if not self.is_feasible_breakpoint(i):
-                continue
-            if self.debug:
+            print('Main loop completed')
+            print('Active nodes=', active_nodes)
+
+        return breaker
+
+    def iter_breakpoints(self,
+                         line_lengths,
+                         tolerance = 1,
+                         fitness_demerit = 100,
+                         flagged_demerit = 100,
+                         emergency_stretch = None,
+                         breakpoints = None,
+                         engine = 'python',
+                         beam_width = None,
+                         ):
+        """Generate the breakpoints that compute_breakpoints() would
+        return, yielding each one as soon as the pass under way is
+        certain of it: once it is an ancestor of every active
+        breakpoint.  So the first lines of a long paragraph can be used
+        before the rest of it is broken.
+
+        With several tolerances, if the pass at one of them fails, the
+        pass at the next keeps the lines already yielded rather than
+        going back to where it would otherwise resume, and so does the
+        emergency pass; so the breaks may then differ from those
+        compute_breakpoints() would choose.  RuntimeError is raised at
+        the point where every tolerance has failed, if there is no
+        emergency stretch.
+
+        The arguments are the same as for compute_breakpoints().
+        """
+
+        if len(self) == 0: return       # No text, so no breaks
+
+        breaker = self._breaker(line_lengths, tolerance, fitness_demerit,
+                                flagged_demerit, emergency_stretch,
+                                breakpoints, engine, merge = True)
+        breaker.beam_width = beam_width
+        breaker.streaming = True
+        for active_nodes in breaker.steps():
+            for A in breaker.commit(active_nodes):
+                yield A.position
+
+        # Find the active node with the lowest number of demerits, and
+        # yield the rest of the breakpoints leading to it.
+        active_nodes = breaker.active_nodes
+        A = min(active_nodes, key=lambda A: A.demerits)
+        rest = []
+        while A is not breaker.committed:
+            rest.append(A.position)
+            A = A.previous
+        yield from reversed(rest)
+
+    def _breaker(self, line_lengths, tolerance, fitness_demerit,
+                 flagged_demerit, emergency_stretch, breakpoints, engine,
+                 merge):
+        """Return a breaker to run the main loop with these arguments,
+        merging nodes past the easy line if 'merge' is true."""
+
+        if isinstance(tolerance, (int, float)):
+            tolerance = (tolerance,)
+
+        try:
+            breaker_class = _engines[engine]
+        except KeyError:
+            raise ValueError('unknown engine {!r}'.format(engine))
+
+        if breakpoints is None:
+            breakpoints = self.feasible_breakpoints()
+
+        breaker = breaker_class(self, line_lengths, tuple(tolerance),
+                                fitness_demerit, flagged_demerit,
+                                emergency_stretch, breakpoints)
+        if merge:
+            breaker.easy_line = find_easy_line(line_lengths)
+        return breaker
+
+
+def find_easy_line(line_lengths):
+    """Return the index of the first line from which every line in
+    'line_lengths' has the same length, or None if that is not known.
+
+    An object that knows this can say so with an 'easy_line'
+    attribute.  For a list or tuple, whose last length is reused for
+    every later line, it is where the run of lengths equal to the last
+    one begins.
+    """
+    easy_line = getattr(line_lengths, 'easy_line', None)
+    if easy_line is not None:
+        return easy_line
+    if isinstance(line_lengths, (list, tuple)) and line_lengths:
+        i = len(line_lengths) - 1
+        while i and line_lengths[i - 1] == line_lengths[i]:
+            i -= 1
+        return i
+    return None
+
+def _path(A):
+    "Return the positions of the breaks leading up to node A."
+    breaks = []
+    while A is not None:
+        breaks.append( A.position )
+        A = A.previous
+    breaks.reverse()
+    return breaks
+
+def _alternatives(active_nodes):
+    """Return the alternatives that compute_breakpoint_alternatives()
+    returns, given the active nodes left after the last breakpoint."""
+
+    # The active nodes are kept apart by line number, so the one with
+    # the fewest demerits for each number of lines ends the best way of
+    # setting the paragraph in that many lines.  Iteration visits them
+    # in order of line number.
+    best = {}
+    for A in active_nodes:
+        if A.line not in best or A.demerits < best[A.line].demerits:
+            best[A.line] = A
+    return {line: (A.demerits, _path(A)) for line, A in best.items()}
+
+
+def choose_line_count(alternatives, looseness = 0):
+    """Return the number of lines to use, given the 'alternatives'
+    returned by compute_breakpoint_alternatives().
+
+    With a looseness of zero, this is the number of lines with the
+    fewest demerits.  Otherwise it is the available number of lines
+    closest to that optimum plus 'looseness', but no further from the
+    optimum than that; so the paragraph is made as much looser (or
+    tighter) as it can be, up to the amount asked for.
+    """
+    optimum = min(alternatives, key=lambda n: alternatives[n][0])
+    target = optimum + looseness
+    low, high = min(optimum, target), max(optimum, target)
+    return min((n for n in alternatives if low <= n <= high),
+               key=lambda n: abs(target - n))
+
+
+class _Breaker:
+    """Internal class that runs the main loop of compute_breakpoints().
+
+    The loop runs once per tolerance, but a pass at a larger tolerance
+    never starts over from the beginning of the paragraph.  Until the
+    first breakpoint where a larger tolerance would accept a line that
+    the current pass rejects, a pass at that tolerance would do exactly
+    the same work; so the active nodes are saved at that breakpoint,
+    and if the current pass fails, the next pass resumes from there.
+    The running sums are computed once and shared by every pass.
+
+    If 'easy_line' is set, active nodes on the lines from there on are
+    merged; see _ActiveNodes.  If 'beam_width' is set, each fitness class
+    keeps at most that many active nodes, and 'pruned_floor' records the
+    fewest demerits any setting through a dropped node could have.
+
+    If 'checkpoint_interval' is set, the state of each pass is recorded
+    every that many breakpoints, and if 'previous' is the breaker of an
+    earlier run over the same list, each pass skips ahead to the last
+    of its checkpoints that the changes since then leave valid: one
+    before the first changed item, 'changed', that consulted no line
+    whose length has changed.
+    """
+
+    checkpoint_interval = None
+    easy_line = None
+    beam_width = None
+    pruned_floor = float('inf')
+    forced = None
+    previous = None
+    changed = 0
+    streaming = False
+    committed = None
+    committed_depth = None
+    stats = None
+
+    def __init__(self, olist, line_lengths, tolerances,
+                 fitness_demerit, flagged_demerit, emergency_stretch,
+                 breakpoints):
+        self.olist = olist
+        self.breakpoints = breakpoints
+        self.line_lengths = line_lengths
+        self.tolerances = tolerances
+        self.fitness_demerit = fitness_demerit
+        self.flagged_demerit = flagged_demerit
+        self.emergency_stretch = emergency_stretch
+
+        # Saved (position, active node list) pairs, keyed by the index
+        # of the tolerance whose pass would resume from them.
+        self.snapshots = {}
+
+        # The length of each line consulted so far.
+        self.lengths = []
+
+        # For each pass, keyed by (level, final): the position it
+        # started from, the levels that had snapshots then, and a list
+        # of (position, active node list, snapshots, number of lengths
+        # consulted, pruned_floor) checkpoints.
+        self.checkpoints = {}
+        self.changed_line = 0
+
+    def run(self):
+        "Return the active nodes left after the last breakpoint."
+
+        for active_nodes in self.steps():
+            pass
+        return self.active_nodes
+
+    def prepare(self):
+        "Precompute whatever the passes need."
+        self.olist.compute_sums()
+
+    def steps(self):
+        """Run the passes, leaving the active nodes after the last
+        breakpoint in 'active_nodes'.  If 'streaming' is set, yield the
+        active nodes after every breakpoint along the way."""
+
+        self.prepare()
+
+        # Initialize list of active nodes to a single break at the
+        # beginning of the text.
+        root = _BreakNode(position=0, line=0, fitness_class = 1,
+                          totalwidth = 0, totalstretch = 0,
+                          totalshrink = 0, demerits = 0)
+        level, start, nodes = 0, 0, [root]
+
+        previous = self.previous
+        if previous is not None:
+            self.changed_line = len(previous.lengths)
+            for k, length in enumerate(previous.lengths):
+                if self.line_length(k) != length:
+                    self.changed_line = k
+                    break
+
+        while True:
+            start, nodes = self.restore((level, False), start, nodes)
+            active_nodes = self.new_active_nodes(nodes)
+            if (yield from self.run_pass(level, start, active_nodes)):
+                if self.stats is not None:
+                    self.stats.tolerances[self.tolerances[level]] += 1
+                self.active_nodes = active_nodes
+                return
+
+            # A pass at any tolerance without a snapshot would fail in
+            # exactly the same way, so move on to the lowest one that
+            # has a snapshot.
+            later = [l for l in self.snapshots if l > level]
+            if not later:
+                break
+            level = min(later)
+            start, nodes = self.follow_committed(*self.snapshots.pop(level))
+
+        if self.emergency_stretch is None:
+            raise RuntimeError('no solutions for this paragraph within a'
+                               ' bound of tolerance={}'
+                               .format(self.tolerances[-1]))
+
+        # The final pass starts over, except that lines already
+        # committed to by a streaming run stay as they are.
+        level = len(self.tolerances) - 1
+        committed = self.committed
+        if committed is None or committed is root:
+            start, nodes = 0, [root]
+        else:
+            start, nodes = committed.position + 1, [committed]
+        start, nodes = self.restore((level, True), start, nodes)
+        active_nodes = self.new_active_nodes(nodes)
+        yield from self.run_pass(level, start, active_nodes, final = True)
+        if self.stats is not None:
+            self.stats.tolerances[None] += 1
+        self.active_nodes = active_nodes
+
+    def commit(self, active_nodes):
+        """Return a list of the nodes, oldest first, that have newly
+        become common ancestors of every active node, and record the
+        last of them in 'committed'.  A later pass keeps to them; see
+        follow_committed().
+        """
+        nodes = active_nodes
+
+        # A common ancestor can only be found further on once the
+        # shallowest of the nodes is deeper than before.
+        depth = min(A.line for A in nodes)
+        if depth == self.committed_depth:
+            return []
+        self.committed_depth = depth
+
+        ancestors = set()
+        for A in nodes:
+            while A.line > depth:
+                A = A.previous
+            ancestors.add(A)
+        while len(ancestors) > 1:
+            ancestors = {A.previous for A in ancestors}
+        ancestor = ancestors.pop()
+
+        new = []
+        A = ancestor
+        while A is not self.committed:
+            new.append(A)
+            A = A.previous
+        new.reverse()
+        self.committed = ancestor
+        return new
+
+    def follow_committed(self, start, nodes):
+        """Return the position and active nodes for a pass to resume
+        from, given those of a snapshot, keeping to the lines already
+        committed.  If the committed node is at or past 'start', the
+        pass starts right after it; otherwise only the nodes that
+        descend from it are kept."""
+        committed = self.committed
+        if committed is None or committed.previous is None:
+            return start, nodes
+        if committed.position >= start:
+            return committed.position + 1, [committed]
+        kept = []
+        for A in nodes:
+            B = A
+            while B.position > committed.position:
+                B = B.previous
+            if B is committed:
+                kept.append(A)
+        return start, kept
+
+    def restore(self, key, start, nodes):
+        """Start recording checkpoints for the pass 'key', due to start
+        from position 'start' with the active 'nodes', and return the
+        position and nodes it can start from instead, if a checkpoint
+        of the previous run is still valid."""
+
+        levels = sorted(self.snapshots)
+        checkpoints = []
+        self.checkpoints[key] = (start, levels, checkpoints)
+        previous = self.previous
+        if previous is None or key not in previous.checkpoints:
+            return start, nodes
+
+        # The pass behaves the same as before, up to the first change,
+        # only if it starts from the same place and with snapshots
+        # pending for the same levels.
+        old_start, old_levels, old = previous.checkpoints[key]
+        if old_start != start or old_levels != levels:
+            return start, nodes
+        usable = 0
+        for i, _, _, n, _ in old:
+            if i > self.changed or n > self.changed_line:
+                break
+            usable += 1
+        if not usable:
+            return start, nodes
+
+        # The pass re-records the checkpoint it resumes from.  Nodes
+        # pruned before it are gone from its nodes and snapshots, so
+        # their floor still bounds the result.
+        checkpoints.extend(old[:usable-1])
+        i, nodes, snapshots, _, pruned_floor = old[usable-1]
+        self.pruned_floor = min(self.pruned_floor, pruned_floor)
+        for level, snapshot in snapshots.items():
+            if level not in levels:
+                self.snapshots[level] = snapshot
+        return i, nodes
+
+    def run_pass(self, level, start, active_nodes, final = False):
+        """Run the main loop from item 'start' onward at the tolerance
+        with index 'level', updating 'active_nodes'.  This is a
+        generator, to be run with 'yield from', which yields the active
+        nodes after each breakpoint if 'streaming' is set, and returns
+        false if they ran out before the end of the paragraph.
+
+        In the final pass, every line gets the emergency stretch, and if
+        the last active nodes are about to be deactivated without any
+        feasible break having been found, the best of them is used to
+        make an overfull (or underfull) line.
+        """
+        debug = self.olist.debug
+        tolerances = self.tolerances
+        tolerance = tolerances[level]
+        extra_stretch = self.emergency_stretch if final else 0
+        evaluate = self.evaluate
+        interval = self.checkpoint_interval
+        checkpoints = self.checkpoints[level, final][2]
+        streaming = self.streaming
+        stats = self.stats
+        if stats is not None:
+            stats.passes += 1
+        beam_width = self.beam_width
+        line_spread = LINE_SPREAD
+
+        p = self.olist.penalties
+        breakpoints = self.breakpoints
+        breakpoints = breakpoints[bisect_left(breakpoints, start):]
+
+        # Levels from level+1 through 'top' have no snapshot yet; a
+        # rejected line whose ratio is within 'top_tolerance' is where
+        # the passes at some of them would diverge from this one.
+        top = min([l for l in self.snapshots if l > level],
+                  default=len(tolerances)) - 1
+        top_tolerance = tolerances[top] if top > level else -INFINITY
+
+        if debug:
+            print('Looping over %i breakpoints' % len(breakpoints))
+
+        for n, i in enumerate(breakpoints):
+            if interval and n % interval == 0:
+                checkpoints.append((i, list(active_nodes),
+                                    dict(self.snapshots), len(self.lengths),
+                                    self.pruned_floor))
+
+            # Only penalties have a nonzero penalty value.
+            forced = p[i] == -INFINITY
+            if debug:
                 print('Feasible breakpoint at %i:' % i)
                 print('\tCurrent active node list:', active_nodes)
 
-            if self.debug:
+            if debug:
                 # Print the list of active nodes, sorting them
                 # so they can be visually checked for uniqueness.
                 def key_f(n):
                     return (n.line, n.position, n.fitness_class)
-                active_nodes.sort(key=key_f)
-                for A in active_nodes:
+                for A in sorted(active_nodes, key=key_f):
                     print(A.position, A.line, A.fitness_class)
                 print ; print
 
-            # Loop over the list of active nodes, and compute the fitness
-            # of the line formed by breaking at A and B.  The resulting
-            breaks = []                 # List of feasible breaks
-            for A in active_nodes[:]:
-                try:
-                    available_length = line_lengths[A.line]
-                except IndexError:
-                    available_length = line_lengths[-1]
-                # _debug = hasattr(self[A.position], "character") and self[A.position].character == "sub"
-                r = self.compute_adjustment_ratio(A.position, i, available_length)
-                if self.debug:
-                    print('\tr=', r)
-                    print('\tline=', A.line)
-
-                # #print(r)
-                # if r<-1 or B.is_forced_break():
-                #     #continue
-                #     # Deactivate node A
-                #     if len(active_nodes) == 1:
-                #         if self.debug:
-                #             print "Can't remove last node!"
-                #             # XXX how should this be handled?
-                #             # Raise an exception?
-                #     else:
-                #         if self.debug:
-                #             print '\tRemoving node', A
-                #         active_nodes.remove(A)
-
-                # TODO: eliminate one of these?
-                assert B.is_forced_break() == self.is_forced_break(i)
-
-                if r < -1 or B.is_forced_break():
-                    active_nodes.remove(A)
-
-                tolerable = (-1 <= r <= tolerance)
-                # print r, tolerable
-                if not tolerable:
-                    continue
-
-                # Compute demerits and fitness class
-                if p[i] >= 0:
-                    demerits = (1 + 100 * abs(r)**3 + p[i]) ** 3
-                elif self.is_forced_break(i):
-                    demerits = (1 + 100 * abs(r)**3) ** 2 - p[i]**2
-                else:
-                    demerits = (1 + 100 * abs(r)**3) ** 2
-                demerits += flagged_demerit * f[i] * f[A.position]
-
-                # Figure out the fitness class of this line (tight, loose,
-                # very tight or very loose).
-                if   r < -.5: fitness_class = 0
-                elif r <= .5: fitness_class = 1
-                elif r <= 1:  fitness_class = 2
-                else:         fitness_class = 3
-
-                # If two consecutive lines are in very
-                # different fitness classes, add to the
-                # demerit score for this break.
-                if abs(fitness_class - A.fitness_class) > 1:
-                    demerits += fitness_demerit
-
-                if self.debug:
-                    print('\tDemerits=', demerits)
-                    print('\tFitness class=', fitness_class)
-
-                # Record a feasible break from A to B
-                brk = _BreakNode(position = i, line = A.line + 1,
-                              fitness_class = fitness_class,
-                              totalwidth = self.sum_width[i],
-                              totalstretch = self.sum_stretch[i],
-                              totalshrink = self.sum_shrink[i],
-                              demerits = demerits,
-                              previous = A)
-                breaks.append(brk)
-                # print '=========='
-                if self.debug:
-                    print('\tRecording feasible break', B)
-                    print('\t\tDemerits=', demerits)
-                    print('\t\tFitness class=', fitness_class)
-
-                #print(r)
-
-                    # #continue
-                    # # Deactivate node A
-                    # if len(active_nodes) == 1:
-                    #     if self.debug:
-                    #         print "Can't remove last node!"
-                    #         # XXX how should this be handled?
-                    #         # Raise an exception?
-                    # else:
-                    #     if self.debug:
-                    #         print '\tRemoving node', A
-                    #     active_nodes.remove(A)
-
-            # end for A in active_nodes
+            breaks, deactivated, rejected = evaluate(
+                i, forced, active_nodes, tolerance, extra_stretch)
+
+            if rejected is not None and rejected <= top_tolerance:
+                top = self.save_snapshot(level, top, i, rejected,
+                                         active_nodes)
+                top_tolerance = tolerances[top] if top > level else -INFINITY
+
+            if (final and not breaks and deactivated
+                    and len(deactivated) == len(active_nodes)):
+                breaks.append(self.artificial_break(i, deactivated,
+                                                    extra_stretch))
+            if stats is not None:
+                n = len(active_nodes)
+                stats.evaluations += 1
+                stats.active += n
+                if n > stats.peak_active:
+                    stats.peak_active = n
+                stats.created += len(breaks)
+                stats.deactivated += len(deactivated)
+            for A in deactivated:
+                active_nodes.remove(A)
             if breaks:
-                if self.debug:
+                if debug:
                     print('List of breaks at ', i, ':', breaks)
-                self.add_active_nodes(active_nodes, breaks)
+                if line_spread is not None and len(breaks) > 1:
+                    breaks = self.bound_line_counts(breaks, line_spread)
+                for brk in breaks:
+                    active_nodes.add(brk)
+                if beam_width and len(active_nodes) > beam_width:
+                    self.prune(active_nodes)
 
             if not active_nodes:
-                raise RuntimeError('no solutions for this paragraph within a'
-                                   ' bound of tolerance={}'.format(tolerance))
+                return False
+            if streaming:
+                yield active_nodes
 
-        # end for i in range(m)
+        # end for i in breakpoints
+        return True
 
-        if self.debug:
-            print('Main loop completed')
-            print('Active nodes=', active_nodes)
+    def evaluate(self, i, forced, active_nodes, tolerance, extra_stretch):
+        """Evaluate the line from each active node to breakpoint 'i'.
 
-        # Find the active node with the lowest number of demerits.
-        least_demerits = min(A.demerits for A in active_nodes)
+        Return a list of new feasible breaks, a list of the nodes to
+        deactivate, and the smallest adjustment ratio of any line that
+        was rejected only for exceeding 'tolerance' (or None).
+        """
+        olist = self.olist
+        debug = olist.debug
+        lengths = self.lengths
+        fitness_demerit = self.fitness_demerit
+        flagged_demerit = self.flagged_demerit
+
+        # Read the numeric values for each item straight from the
+        # columns.  The variable names follow those in Knuth's
+        # description.
+        p = olist.penalties
+        f = olist.flags
+
+        # The running sums were computed by prepare(), so the width,
+        # stretch, and shrink of each line are found as in
+        # compute_adjustment_ratio(), without calling it.
+        sum_width = olist.sum_width
+        sum_stretch = olist.sum_stretch
+        sum_shrink = olist.sum_shrink
+        width_i = sum_width[i]
+        stretch_i = sum_stretch[i]
+        shrink_i = sum_shrink[i]
+        penalty_width = olist.widths[i] if olist.kinds[i] == PENALTY else 0
+
+        # Loop over the list of active nodes, and compute the fitness
+        # of the line formed by breaking at A and B.  The resulting
+        breaks = []                     # List of feasible breaks
+        deactivated = []                # Nodes to remove afterwards
+        rejected = None
         for A in active_nodes:
-            if A.demerits == least_demerits:
-                break
-        # L = map(lambda A: (A.demerits, A), active_nodes)
-        # L.sort()
-        # _, A = L[0]
-
-        if looseness != 0:
-            # The search for the appropriate active node is a bit more
-            # complicated; we look for a node with a paragraph length
-            # that's as close as possible to (A.line+looseness), and
-            # with the minimum number of demerits.
-
-            best = 0
-            d = INFINITY
-            for br in active_nodes:
-                delta = br.line - A.line
-                # The two branches of this 'if' statement
-                # are for handling values of looseness that are
-                # either positive or negative.
-                if ((looseness<= delta < best) or
-                    (best<delta<looseness) ):
-                    s = delta
-                    d = br.demerits
-                    b = br
-
-                elif delta == best and br.demerits < d:
-                    # This break is of the same length, but has fewer
-                    # demerits and hence is a more attractive one.
-                    d = br.demerits
-                    b = br
-
-            A = b
-
-        # Use the chosen node A to determine the optimum breakpoints,
-        # and return the resulting list of breakpoints.
-        breaks = []
-        while A is not None:
-            breaks.append( A.position )
-            A = A.previous
-        breaks.reverse()
-        return breaks
+            try:
+                available_length = lengths[A.line]
+            except IndexError:
+                available_length = self.line_length(A.line)
+            position = A.position
+            length = width_i - sum_width[position] + penalty_width
+            if length < available_length:
+                y = stretch_i - sum_stretch[position] + extra_stretch
+                if y > 0:
+                    r = (available_length - length) / float(y)
+                else:
+                    r = INFINITY
+            elif length > available_length:
+                z = shrink_i - sum_shrink[position]
+                if z > 0:
+                    r = (available_length - length) / float(z)
+                else:
+                    r = INFINITY
+            else:
+                r = 0
+            if debug:
+                print('\tr=', r)
+                print('\tline=', A.line)
+
+            if r < -1 or forced:
+                deactivated.append(A)
+
+            if r > tolerance:
+                if rejected is None or r < rejected:
+                    rejected = r
+                continue
+            elif r < -1:
+                continue
+
+            # Compute demerits and fitness class.  (Powers are written
+            # out as products, so the vectorized engine can match them
+            # bit for bit.)
+            a = abs(r)
+            if p[i] >= 0:
+                d = 1 + 100 * a * a * a + p[i]
+                demerits = d * d * d
+            elif forced:
+                d = 1 + 100 * a * a * a
+                demerits = d * d - p[i] * p[i]
+            else:
+                d = 1 + 100 * a * a * a
+                demerits = d * d
+            demerits += flagged_demerit * f[i] * f[position]
+
+            # Figure out the fitness class of this line (tight, loose,
+            # very tight or very loose).
+            if   r < -.5: fitness_class = 0
+            elif r <= .5: fitness_class = 1
+            elif r <= 1:  fitness_class = 2
+            else:         fitness_class = 3
+
+            # If two consecutive lines are in very
+            # different fitness classes, add to the
+            # demerit score for this break.
+            if abs(fitness_class - A.fitness_class) > 1:
+                demerits += fitness_demerit
+
+            # The demerits of a break are the total for every line
+            # of the paragraph up to and including this one.
+            demerits += A.demerits
+
+            if debug:
+                print('\tDemerits=', demerits)
+                print('\tFitness class=', fitness_class)
+
+            # Record a feasible break from A to B
+            brk = _BreakNode(position = i, line = A.line + 1,
+                             fitness_class = fitness_class,
+                             totalwidth = width_i,
+                             totalstretch = stretch_i,
+                             totalshrink = shrink_i,
+                             demerits = demerits,
+                             previous = A)
+            breaks.append(brk)
+            if debug:
+                print('\tRecording feasible break', i)
+                print('\t\tDemerits=', demerits)
+                print('\t\tFitness class=', fitness_class)
+
+        return breaks, deactivated, rejected
+
+    def new_active_nodes(self, nodes):
+        return _ActiveNodes(nodes, self.easy_line)
+
+    def bound_line_counts(self, breaks, line_spread):
+        """Return the new 'breaks' at a breakpoint, less those whose
+        number of lines is more than 'line_spread' away from that of
+        the one with the fewest demerits.  Lines past 'easy_line' count
+        as the same number, as they are merged anyway.
+
+        Unmerged, a breakpoint can be reached in every number of lines
+        between the fewest and the most that fit, a range that widens
+        along the paragraph; bounding it keeps the active nodes from
+        growing with the paragraph's length, at the cost of settings
+        far looser or tighter than the best, which neither looseness
+        nor the best setting reaches.
+        """
+        easy_line = self.easy_line
+        if easy_line is None:
+            easy_line = float('inf')
+        best = min(breaks, key=lambda A: A.demerits)
+        best_line = min(best.line, easy_line)
+        return [A for A in breaks
+                if abs(min(A.line, easy_line) - best_line) <= line_spread]
+
+    def prune(self, active_nodes):
+        """Deactivate all but the 'beam_width' nodes with the fewest
+        demerits in each fitness class, lowering 'pruned_floor' to the
+        floor() of the best node dropped.
+
+        Every active node lies after the same forced breaks, so floor()
+        ranks them as their demerits do, and the best node dropped
+        bounds every other one dropped with it.
+        """
+
+        classes = {}
+        for A in active_nodes:
+            classes.setdefault(A.fitness_class, []).append(A)
+        beam_width = self.beam_width
+        best = None
+        for nodes in classes.values():
+            if len(nodes) <= beam_width:
+                continue
+            nodes.sort(key=lambda A: A.demerits)
+            for A in nodes[beam_width:]:
+                active_nodes.remove(A)
+            A = nodes[beam_width]
+            if best is None or A.demerits < best.demerits:
+                best = A
+            if self.stats is not None:
+                self.stats.pruned += len(nodes) - beam_width
+        if best is not None:
+            self.pruned_floor = min(self.pruned_floor, self.floor(best))
+
+    def floor(self, A):
+        """Return the fewest demerits that any setting of the paragraph
+        through node A could have.  No line has negative demerits except
+        one ending at a forced break, which has at least one less the
+        square of the penalty."""
+
+        p = self.olist.penalties
+        forced = self.forced
+        if forced is None:
+            forced = self.forced = [i for i in self.breakpoints
+                                    if p[i] == -INFINITY]
+        return A.demerits + sum(1 - p[i] * p[i] for i in
+                                forced[bisect_left(forced, A.position + 1):])
+
+    def deviation(self, demerits):
+        """Return the most by which a setting with 'demerits' may exceed
+        the optimum, given the nodes that were pruned.
+
+        A setting that no pruning cut short was seen to the end, so it
+        has at least the 'demerits' of the best one found; any other
+        passes through a dropped node, and has at least the floor() of
+        the best node dropped at that prune.  The optimum is thus at
+        least the lower of the two.  Since the floor leaves out the
+        lines after the dropped node, the bound is roughly the
+        result's demerits less those of the best node ever dropped.
+        """
+        return max(0.0, demerits - self.pruned_floor)
+
+    def line_length(self, line):
+        """Return the length available for the line with index 'line',
+        consulting 'line_lengths' for every line up to it.  If the
+        sequence is too short, its last value is used for the rest."""
+        lengths = self.lengths
+        while len(lengths) <= line:
+            try:
+                lengths.append(self.line_lengths[len(lengths)])
+            except IndexError:
+                lengths.append(lengths[-1])
+        return lengths[line]
+
+    def save_snapshot(self, level, top, i, r, active_nodes):
+        """Save the active nodes at breakpoint 'i' for each pending
+        level whose tolerance would have accepted a line with ratio 'r',
+        and return the new top pending level."""
+
+        nodes = list(active_nodes)
+        while top > level and self.tolerances[top] >= r:
+            self.snapshots[top] = (i, nodes)
+            top -= 1
+        return top
+
+    def artificial_break(self, i, nodes, extra_stretch):
+        """Return a break at 'i' after the node with the fewest demerits,
+        adding no demerits for the bad line between them."""
+
+        olist = self.olist
+        A = min(nodes, key=lambda A: A.demerits)
+        r = olist.compute_adjustment_ratio(A.position, i,
+                                           self.line_length(A.line),
+                                           extra_stretch)
+        return _BreakNode(position = i, line = A.line + 1,
+                          fitness_class = 0 if r < 0 else 3,
+                          totalwidth = olist.sum_width[i],
+                          totalstretch = olist.sum_stretch[i],
+                          totalshrink = olist.sum_shrink[i],
+                          demerits = A.demerits,
+                          previous = A)
+
+
+class _VectorBreaker(_Breaker):
+    """Internal class that runs the main loop of compute_breakpoints(),
+    evaluating the lines from every active node to a breakpoint at
+    once with NumPy.
+
+    The arithmetic is the same as _Breaker.evaluate(), operation for
+    operation, so the demerits agree to the last bit.  With only a few
+    active nodes the overhead of the array operations outweighs their
+    speed, so the plain loop is used instead.
+    """
+
+    # The fewest active nodes for which the arrays are used.
+    min_nodes = 24
+
+    def __init__(self, *args):
+        import numpy
+        _Breaker.__init__(self, *args)
+        self.numpy = numpy
+        self._lengths = numpy.zeros(0)
+
+    def prepare(self):
+        numpy = self.numpy
+        olist = self.olist
+        olist.compute_sums()
+        self.sum_width = numpy.array(olist.sum_width)
+        self.sum_stretch = numpy.array(olist.sum_stretch)
+        self.sum_shrink = numpy.array(olist.sum_shrink)
+        self.flags = numpy.array(olist.flags, numpy.int64)
+
+    def new_active_nodes(self, nodes):
+        return _ActiveArrays(self.numpy, nodes, self.easy_line)
+
+    def available_lengths(self, lines):
+        "Return an array of the lengths available for 'lines'."
+        lengths = self._lengths
+        top = int(lines.max())
+        if top >= len(lengths):
+            self.line_length(top)
+            lengths = self._lengths = self.numpy.array(self.lengths, float)
+        return lengths[lines]
+
+    def evaluate(self, i, forced, active_nodes, tolerance, extra_stretch):
+        olist = self.olist
+        if len(active_nodes) < self.min_nodes or olist.debug:
+            return _Breaker.evaluate(self, i, forced, active_nodes,
+                                     tolerance, extra_stretch)
+        numpy = self.numpy
+        slots = active_nodes.live_slots()
+        lines = active_nodes.line[slots]
+        positions = active_nodes.position[slots]
+
+        # Compute every adjustment ratio as compute_adjustment_ratio()
+        # would.
+        length = self.sum_width[i] - self.sum_width[positions]
+        if olist.kinds[i] == PENALTY: length += olist.widths[i]
+        available_length = self.available_lengths(lines)
+        y = self.sum_stretch[i] - self.sum_stretch[positions] + extra_stretch
+        z = self.sum_shrink[i] - self.sum_shrink[positions]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            r = numpy.where(
+                length < available_length,
+                numpy.where(y > 0, (available_length - length) / y,
+                            INFINITY),
+                numpy.where(length > available_length,
+                            numpy.where(z > 0,
+                                        (available_length - length) / z,
+                                        INFINITY),
+                            0.))
+
+        nodes = active_nodes.nodes
+        if forced:
+            deactivated = [nodes[s] for s in slots.tolist()]
+        else:
+            deactivated = [nodes[s] for s in slots[r < -1].tolist()]
+        over = r[r > tolerance]
+        rejected = over.min().item() if len(over) else None
+
+        k = numpy.flatnonzero((r >= -1) & (r <= tolerance))
+        if not len(k):
+            return [], deactivated, rejected
+        slots = slots[k]
+        r = r[k]
+
+        # Compute demerits and fitness classes.
+        p = olist.penalties[i]
+        a = numpy.abs(r)
+        if p >= 0:
+            d = 1 + 100 * a * a * a + p
+            demerits = d * d * d
+        elif forced:
+            d = 1 + 100 * a * a * a
+            demerits = d * d - p * p
+        else:
+            d = 1 + 100 * a * a * a
+            demerits = d * d
+        demerits += (self.flagged_demerit * olist.flags[i]
+                     * self.flags[positions[k]])
+        fitness_class = numpy.where(
+            r < -.5, 0, numpy.where(r <= .5, 1, numpy.where(r <= 1, 2, 3)))
+        jump = abs(fitness_class - active_nodes.fitness_class[slots]) > 1
+        demerits[jump] += self.fitness_demerit
+        demerits += active_nodes.demerits[slots]
+
+        totalwidth = olist.sum_width[i]
+        totalstretch = olist.sum_stretch[i]
+        totalshrink = olist.sum_shrink[i]
+        breaks = [_BreakNode(position = i, line = line + 1,
+                             fitness_class = c,
+                             totalwidth = totalwidth,
+                             totalstretch = totalstretch,
+                             totalshrink = totalshrink,
+                             demerits = e,
+                             previous = nodes[s])
+                  for s, line, c, e in zip(slots.tolist(),
+                                           lines[k].tolist(),
+                                           fitness_class.tolist(),
+                                           demerits.tolist())]
+        return breaks, deactivated, rejected
+
+_engines = {'python': _Breaker, 'numpy': _VectorBreaker}
 
 
 # Simple test code.
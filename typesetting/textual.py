@@ -1,3 +1,4 @@
+from .glyphs import widths_of
 from .units import mm
 
 
@@ -5,11 +6,12 @@ def naive_wrap(font, string, width):
     x = 0 * mm
     line = []
     space = font.width_of(' ')
-    for word in string.split():
-        x = x + font.width_of(word) + space
+    words = string.split()
+    for word, word_width in zip(words, widths_of(font, words)):
+        x = x + word_width + space
         if x > width:
             yield line
             line = []
-            x = font.width_of(word)
+            x = word_width
         line.append(word)
     yield line